@@ -1,3 +1,4 @@
 from .utils import __get_llm as get_llm
-from .utils import ChromaRetriever
+from .utils import ChromaRetriever, ChunkStore
+from .utils import MetricsCallbackHandler, TimedNode, flush_langfuse, get_langfuse_handler
 from .state import GraphState
\ No newline at end of file
@@ -1,3 +1,5 @@
+from utils.metrics import LOAD_SHED, RETRY_DECISIONS
+from .llm import remaining
 from .state import GraphState
 
 def should_retry(state: GraphState) -> str:
@@ -5,7 +7,18 @@ def should_retry(state: GraphState) -> str:
     Retry only if:
     - answer is not relevant
     - retry_count < 1
+    - the request is not degraded (admission pressure)
+    - the request deadline has not passed
     """
-    if not state.get("is_relevant") and state.get("retry_count", 0) < 1:
-        return "rephrase"
-    return "__end__"
\ No newline at end of file
+    left = remaining(state.get("deadline"))
+    if left is not None and left <= 0:
+        decision = "__end__"
+    elif state.get("degraded") and not state.get("is_relevant"):
+        LOAD_SHED.inc(action="retry")
+        decision = "__end__"
+    elif not state.get("is_relevant") and state.get("retry_count", 0) < 1:
+        decision = "rephrase"
+    else:
+        decision = "__end__"
+    RETRY_DECISIONS.inc(decision=decision)
+    return decision
\ No newline at end of file
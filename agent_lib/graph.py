@@ -1,31 +1,34 @@
+import os
+
 from langgraph.graph import StateGraph, END
 from .state import GraphState
 from .nodes import SetChatHistory, StoreChatHistory, Generate, Retrieve, Planner
 from .edges import should_retry
+from .utils import TimedNode
 
-def build_graph(pg_pool, llm, chroma_collection):
+def build_graph(pg_pool, llm, vector_store):
     workflow = StateGraph(GraphState)
 
     # Nodes
     workflow.add_node(
         "set_chat_history",
-        SetChatHistory(pg_pool),
+        TimedNode(SetChatHistory(pg_pool)),
     )
     workflow.add_node(
         "planner",
-        Planner(llm),
+        TimedNode(Planner(llm)),
     )
     workflow.add_node(
         "retrieve",
-        Retrieve(chroma_collection=chroma_collection),   # Chroma + BM25 inside
+        TimedNode(Retrieve(vector_store=vector_store)),   # vector search + BM25 inside
     )
     workflow.add_node(
         "generate",
-        Generate(),   # sets answer + is_relevant
+        TimedNode(Generate()),   # sets answer + is_relevant
     )
     workflow.add_node(
         "store_chat_history",
-        StoreChatHistory(pg_pool),
+        TimedNode(StoreChatHistory(pg_pool)),
     )
 
     # Entry
@@ -51,9 +54,10 @@ def build_graph(pg_pool, llm, chroma_collection):
     workflow.add_edge("store_chat_history", END)
     app = workflow.compile()
 
-    # now draw
-    png_bytes = app.get_graph().draw_mermaid_png()
+    # Rendering goes through the mermaid.ink web API, so only on request
+    if os.getenv("DRAW_GRAPH", "false").lower() == "true":
+        png_bytes = app.get_graph().draw_mermaid_png()
 
-    with open("langgraph_new.png", "wb") as f:
-        f.write(png_bytes)
+        with open("langgraph_new.png", "wb") as f:
+            f.write(png_bytes)
     return app
\ No newline at end of file
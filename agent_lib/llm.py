@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+from utils.metrics import LLM_ATTEMPTS, LLM_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Duplicate a slow request once its wait passes the model's recent p95
+LLM_HEDGING = os.getenv("LLM_HEDGING", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Hedge delay used until enough latencies have been observed
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "1.0"))
+LLM_HEDGE_MIN_SAMPLES = 20
+
+# Upstream failures that move on to the next model
+_FALLBACK_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LatencyWindow:
+    """Most recent latencies of one model and call mode"""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until a time.monotonic() deadline (None = no deadline)"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _outcome(error: BaseException) -> Optional[str]:
+    """Metric label for errors that should fall back to the next model, else None"""
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    status = getattr(error, "status_code", None)
+    if status == 429:
+        return "rate_limited"
+    if status in _FALLBACK_STATUS_CODES or type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return "unavailable"
+    return None
+
+
+class LLMRouter:
+    """
+    Deadline-aware LLM calls with hedging and ordered model fallbacks.
+
+    Each call tries models in order. An attempt must produce its first
+    token (streams) or its response (ainvoke) within timeout seconds,
+    capped by the request deadline. If it has not by the model's recent
+    p95 latency for that call mode, one duplicate request is sent and
+    whichever answers first wins. The loser is cancelled, which closes
+    its HTTP stream. Timeouts, 429s and 5xx
+    responses move on to the next model; other errors are raised.
+
+    Exposes ainvoke and astream like a LangChain chat model, with an
+    extra deadline argument (a time.monotonic() value).
+    """
+
+    def __init__(self, models: List[str], timeout: float, temperature: float = 0.2,
+                 hedging: bool = LLM_HEDGING):
+        self.models = models
+        self.timeout = timeout
+        self.temperature = temperature
+        self.hedging = hedging
+        self._clients: Dict[str, object] = {}
+        self._latency: Dict[tuple, LatencyWindow] = {}
+
+    @classmethod
+    def from_env(cls, name: str, models: List[str], timeout: float, temperature: float = 0.2):
+        """Read <NAME>_MODELS (comma-separated, in fallback order) and <NAME>_TIMEOUT"""
+        prefix = name.upper()
+        configured = os.getenv(f"{prefix}_MODELS")
+        if configured:
+            models = [model.strip() for model in configured.split(",") if model.strip()]
+        return cls(
+            models,
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+            temperature=temperature,
+        )
+
+    def client(self, model: str):
+        if model not in self._clients:
+            from langchain_groq import ChatGroq
+
+            # Our own deadlines apply; the SDK must not retry behind them
+            self._clients[model] = ChatGroq(
+                temperature=self.temperature,
+                api_key=os.environ.get("GROQ_API_KEY", ""),
+                model_name=model,
+                max_retries=0,
+            )
+        return self._clients[model]
+
+    def hedge_delay(self, model: str, mode: str) -> Optional[float]:
+        if not self.hedging:
+            return None
+        window = self._latency.setdefault((model, mode), LatencyWindow())
+        delay = window.percentile(LLM_HEDGE_PERCENTILE)
+        return LLM_HEDGE_DELAY if delay is None else delay
+
+    def _record(self, model: str, mode: str, seconds: float):
+        self._latency.setdefault((model, mode), LatencyWindow()).add(seconds)
+        LLM_LATENCY.observe(seconds, model=model, mode=mode)
+
+    async def _race(self, model: str, mode: str, start, timeout: float):
+        """
+        Run start(model), hedged once after the model's hedge delay.
+        Return the first successful result; cancel and close the rest.
+
+        The latency window gets the primary attempt's time: its own latency
+        when it wins, else how long it had been running when the hedge won
+        or the timeout hit. Recording the winner instead would hide the
+        slow tail and let the p95, and so the hedge delay, drift down.
+        """
+        started = time.monotonic()
+        ends = started + timeout
+        hedge_delay = self.hedge_delay(model, mode)
+        launched = []
+        pending = set()
+
+        def launch():
+            task = asyncio.create_task(start(model))
+            launched.append(task)
+            pending.add(task)
+
+        launch()
+        primary = next(iter(pending))
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= ends:
+                    if not primary.done():
+                        self._record(model, mode, now - started)
+                    raise asyncio.TimeoutError(f"{model}: no response within {timeout:.1f}s")
+                wait = ends - now
+                can_hedge = hedge_delay is not None and len(launched) == 1
+                if can_hedge:
+                    wait = min(wait, max(0.0, started + hedge_delay - now))
+
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    # Primary won, or it was still waiting (censored at this point)
+                    if primary in winners or not primary.done():
+                        self._record(model, mode, time.monotonic() - started)
+                    for task in winners[1:]:
+                        pending.add(task)
+                    return winners[0].result()
+                for task in done:
+                    error = task.exception()
+                    if _outcome(error) == "rate_limited":
+                        raise error
+
+                if can_hedge and not done and time.monotonic() >= started + hedge_delay:
+                    LLM_ATTEMPTS.inc(model=model, outcome="hedged")
+                    launch()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                # Losers that already opened a stream
+                if isinstance(result, tuple):
+                    await result[0].aclose()
+
+    async def _call(self, mode: str, start, deadline: Optional[float]):
+        """Try each model in order until one responds"""
+        error = None
+        for model in self.models:
+            timeout = self.timeout
+            left = remaining(deadline)
+            if left is not None:
+                timeout = min(timeout, left)
+            if timeout <= 0:
+                raise asyncio.TimeoutError("Request deadline exceeded")
+            try:
+                result = await self._race(model, mode, start, timeout)
+                LLM_ATTEMPTS.inc(model=model, outcome="ok")
+                return model, result
+            except Exception as e:
+                outcome = _outcome(e)
+                if outcome is None:
+                    LLM_ATTEMPTS.inc(model=model, outcome="error")
+                    raise
+                LLM_ATTEMPTS.inc(model=model, outcome=outcome)
+                logger.warning(f"LLM {model} {outcome}, trying next model: {e}")
+                error = e
+        raise error
+
+    async def ainvoke(self, messages, config: Optional[dict] = None, deadline: Optional[float] = None):
+        async def start(model):
+            return await self.client(model).ainvoke(messages, config=config)
+
+        _, response = await self._call("invoke", start, deadline)
+        return response
+
+    async def astream(self, messages, config: Optional[dict] = None,
+                      deadline: Optional[float] = None) -> AsyncIterator:
+        """
+        Stream chunks from the first model to send content. Hedging and
+        fallback only apply before the first token; after it the remaining
+        stream is bounded by the deadline alone.
+        """
+        async def start(model):
+            stream = self.client(model).astream(messages, config=config)
+            head = []
+            try:
+                # The role-only opening chunk does not count as a first token
+                async for chunk in stream:
+                    head.append(chunk)
+                    if chunk.content:
+                        break
+            except BaseException:
+                await stream.aclose()
+                raise
+            return stream, head
+
+        model, (stream, head) = await self._call("stream", start, deadline)
+        try:
+            for chunk in head:
+                yield chunk
+            while True:
+                left = remaining(deadline)
+                if left is not None and left <= 0:
+                    raise asyncio.TimeoutError(f"{model}: request deadline exceeded while streaming")
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=left)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        finally:
+            await stream.aclose()
@@ -13,7 +13,7 @@ class SetChatHistory:
     def __init__(self, async_pool):
         self.async_pool = async_pool
 
-    async def __call__(self, state: GraphState) -> GraphState:
+    async def __call__(self, state: GraphState) -> dict:
         async with self.async_pool.connection() as conn:
             history = PostgresChatMessageHistory(
                 "chat_history",
@@ -27,7 +27,6 @@ class SetChatHistory:
             recent_messages = messages[-12:] if len(messages) > 12 else messages
 
         return {
-            **state,
             "chat_history": recent_messages  # Only recent messages
         }
 
@@ -38,7 +37,7 @@ class StoreChatHistory:
     def __init__(self, async_pool):
         self.async_pool = async_pool
 
-    async def __call__(self, state: GraphState) -> GraphState:
+    async def __call__(self, state: GraphState) -> dict:
         async with self.async_pool.connection() as conn:
             history = PostgresChatMessageHistory(
                 "chat_history",
@@ -52,7 +51,8 @@ class StoreChatHistory:
                 AIMessage(content=state["answer"])
             ])
 
-        return state
+        # Nothing in the state changes
+        return {}
 
 
 class StoreChatHistory:
@@ -61,7 +61,7 @@ class StoreChatHistory:
     def __init__(self, async_pool):
         self.async_pool = async_pool
 
-    async def __call__(self, state: GraphState) -> GraphState:
+    async def __call__(self, state: GraphState) -> dict:
         async with self.async_pool.connection() as conn:
             history = PostgresChatMessageHistory(
                 "chat_history",
@@ -74,4 +74,5 @@ class StoreChatHistory:
                 AIMessage(content=state["answer"])
             ])
 
-        return state
\ No newline at end of file
+        # Nothing in the state changes
+        return {}
\ No newline at end of file
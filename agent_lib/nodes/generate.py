@@ -3,13 +3,17 @@ from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
-from langchain_groq import ChatGroq
-from langfuse.langchain import CallbackHandler
+from ..llm import LLMRouter
 from ..state import GraphState
+from ..utils import ChunkStore
 
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_core.output_parsers import StrOutputParser
 import json
+import re
+
+_ANSWER_KEY_RE = re.compile(r'"answer"\s*:\s*"')
+# Answers below this confidence_score are not relevant and trigger the retry
+GENERATE_RELEVANCE_THRESHOLD = float(os.getenv("GENERATE_RELEVANCE_THRESHOLD", "0.6"))
 
 class AnswerSchema(BaseModel):
     answer: str = Field(..., description="Detailed answer")
@@ -17,24 +21,66 @@ class AnswerSchema(BaseModel):
     confidence_score: Optional[float] = Field(None, ge=0.0, le=1.0)
 
 
+class AnswerStreamExtractor:
+    """
+    Pull the "answer" string value out of a streamed JSON response.
+
+    BUFFERING: accumulate tokens until the "answer" value's opening quote
+    STREAMING: pass answer text through (escape sequences are kept as-is)
+    DONE: answer value closed, ignore the rest of the JSON
+    """
+
+    def __init__(self):
+        self.state = "BUFFERING"
+        self.buffer = ""
+        self.escape_next = False
+
+    def feed(self, content: str) -> str:
+        """Return the part of content that belongs to the answer"""
+        if self.state == "BUFFERING":
+            self.buffer += content
+            match = _ANSWER_KEY_RE.search(self.buffer)
+            if not match:
+                return ""
+            self.state = "STREAMING"
+            content = self.buffer[match.end():]
+            self.buffer = ""
+        elif self.state == "DONE":
+            return ""
+
+        answer_chunk = ""
+        for ch in content:
+            if self.escape_next:
+                answer_chunk += ch
+                self.escape_next = False
+            elif ch == '\\':
+                self.escape_next = True
+                answer_chunk += ch
+            elif ch == '"':
+                self.state = "DONE"
+                break
+            else:
+                answer_chunk += ch
+        return answer_chunk
+
+
 class Generate:
     name = "generate"
 
-    def __init__(self):
-        self.model_name = "llama-3.1-8b-instant"
-        self.temperature = 0.2
+    def __init__(self, llm: Optional[LLMRouter] = None,
+                 relevance_threshold: float = GENERATE_RELEVANCE_THRESHOLD):
+        self.relevance_threshold = relevance_threshold
+        # The first token is on the critical path, hence the short timeout
+        self.llm = llm or LLMRouter.from_env(
+            "generate", ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"], timeout=10.0
+        )
 
-    async def __call__(self, state: GraphState, config: Optional[dict] = None) -> GraphState:
+    async def __call__(self, state: GraphState, config: Optional[dict] = None, writer=None) -> dict:
         """Generate a structured answer using reranked documents."""
-        
-        llm = ChatGroq(
-            temperature=self.temperature,
-            api_key=os.environ["GROQ_API_KEY"],
-            model_name=self.model_name,
-        )
 
         # Build context
-        context = "\n\n".join(state.get("reranked_documents", []))
+        chunk_ids = [chunk["id"] for chunk in state.get("reranked", [])]
+        context = "\n\n".join(ChunkStore.from_config(config).texts(chunk_ids))
 
         # Build messages manually
         messages = [
@@ -55,11 +101,19 @@ Question:
         ]
 
         try:
-            # Stream-compatible chain
-            chain = llm | StrOutputParser()
-            
-            # Invoke with config for streaming support
-            result_text = await chain.ainvoke(messages, config=config)
+            # Stream the completion; only the answer text goes to the custom
+            # stream channel, so the API never sees other nodes' tokens
+            extractor = AnswerStreamExtractor()
+            parts = []
+            async for chunk in self.llm.astream(messages, config=config, deadline=state.get("deadline")):
+                if not chunk.content:
+                    continue
+                parts.append(chunk.content)
+                if writer is not None:
+                    answer_chunk = extractor.feed(chunk.content)
+                    if answer_chunk:
+                        writer({"event": "text", "data": answer_chunk})
+            result_text = "".join(parts)
             
             # Parse JSON manually
             cleaned_text = result_text.strip()
@@ -73,23 +127,20 @@ Question:
             parsed_result = json.loads(cleaned_text.strip())
             
             return {
-                **state,
                 "answer": parsed_result.get("answer", result_text),
                 "supporting_facts": parsed_result.get("supporting_facts", []),
                 "confidence_score": parsed_result.get("confidence_score"),
-                "is_relevant": parsed_result.get("confidence_score", 0.0) >= 0.6
+                "is_relevant": (parsed_result.get("confidence_score") or 0.0) >= self.relevance_threshold
             }
             
         except json.JSONDecodeError:
             # Fallback if JSON parsing fails
             return {
-                **state,
                 "answer": result_text,
                 "is_relevant": False 
             }
         except Exception as e:
             print("Generation error:", e)
             return {
-                **state,
                 "answer": "I encountered an issue while generating the answer. Please try rephrasing.",
             }
\ No newline at end of file
@@ -1,38 +1,89 @@
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from ..state import GraphState
+import logging
+import os
+import re
 
 from langchain_core.messages import SystemMessage, HumanMessage
+from utils.metrics import LOAD_SHED
 from ..state import GraphState
 
+logger = logging.getLogger(__name__)
+
+# Query variants generated per question (1 = a single rewritten query)
+PLANNER_QUERY_VARIANTS = int(os.getenv("PLANNER_QUERY_VARIANTS", "1"))
+
+_LIST_MARKER_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+def parse_query_variants(text: str, limit: int):
+    """One query per line; strip list markers and quotes, drop duplicates"""
+    variants = []
+    for line in text.splitlines():
+        variant = _LIST_MARKER_RE.sub("", line).strip().strip('"').strip()
+        if variant and variant.lower() not in (v.lower() for v in variants):
+            variants.append(variant)
+    return variants[:limit]
+
+
 class Planner:
     name = "planner"
 
-    def __init__(self, llm):
+    def __init__(self, llm, num_variants: int = PLANNER_QUERY_VARIANTS):
         self.llm = llm
+        self.num_variants = max(1, num_variants)
 
-    async def __call__(self, state: GraphState, config: dict = None) -> GraphState:
-        # Build messages manually
-        messages = [
-            SystemMessage(content=(
+    def _instructions(self) -> str:
+        if self.num_variants == 1:
+            return (
                 "You are a query planner for a RAG system. "
                 "Given the chat history and the latest user question, "
                 "rewrite the question into a clear, standalone query "
                 "optimized for semantic document retrieval. "
                 "Do NOT answer the question. "
                 "Return ONLY the rewritten query into a meaningful query based on chat history and current user question."
-            )),
+            )
+        return (
+            "You are a query planner for a RAG system. "
+            "Given the chat history and the latest user question, "
+            f"write {self.num_variants} different standalone search queries "
+            "optimized for semantic document retrieval. "
+            "The first line must be the question rewritten as a clear, standalone query; "
+            "the others should use different wording, synonyms or a narrower focus. "
+            "Do NOT answer the question. "
+            "Return ONLY the queries, one per line, without numbering."
+        )
+
+    async def __call__(self, state: GraphState, config: dict = None) -> dict:
+        # Under admission pressure search with the question as asked
+        if state.get("degraded"):
+            LOAD_SHED.inc(action="planner")
+            return {"queries": [state["query"]]}
+
+        # Build messages manually
+        messages = [
+            SystemMessage(content=self._instructions()),
             *state.get("chat_history", []), 
             HumanMessage(content=state["query"])
         ]
         
-        response = await self.llm.ainvoke(messages, config=config)
-        planned_query = response.content.strip()
+        try:
+            response = await self.llm.ainvoke(messages, config=config, deadline=state.get("deadline"))
+        except Exception as e:
+            # Every model timed out or failed; retrieval can still use the question
+            logger.warning(f"Planner LLM unavailable, using the original query: {e}")
+            response = None
+
+        if response is None:
+            queries = []
+        elif self.num_variants == 1:
+            queries = [response.content.strip()] if response.content.strip() else []
+        else:
+            queries = parse_query_variants(response.content, self.num_variants)
 
         # Safety fallback
-        if not planned_query:
-            planned_query = state["query"]
+        if not queries:
+            queries = [state["query"]]
 
         return {
-            **state,
-            "query": planned_query
-        }
\ No newline at end of file
+            "query": queries[0],
+            "queries": queries,
+        }
@@ -1,49 +1,80 @@
+import os
+from typing import Optional
+
+from utils.metrics import RETRIEVAL_STAGE_LATENCY
 from utils.utils import BM25Reranker
 from ..state import GraphState
-from ..utils import ChromaRetriever
+from ..utils import ChromaRetriever, ChunkStore, reciprocal_rank_fusion
+
+# How much deeper the self-correction retry searches, as a multiple of top_k_retrieve
+RETRY_RETRIEVE_MULTIPLIER = int(os.getenv("RETRY_RETRIEVE_MULTIPLIER", "2"))
+# Candidates fetched per query and chunks kept after reranking (see bench/retrieval_sweep.py)
+RETRIEVE_TOP_K = int(os.getenv("RETRIEVE_TOP_K", "15"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "8"))
+
 
 class Retrieve:
     name = "retrieve"
 
     def __init__(
         self,
-        chroma_collection,
-        top_k_retrieve: int = 15,
-        top_k_rerank: int = 8,
+        vector_store,
+        top_k_retrieve: int = RETRIEVE_TOP_K,
+        top_k_rerank: int = RERANK_TOP_K,
+        reranker=None,
     ):
         self.top_k_retrieve = top_k_retrieve
         self.top_k_rerank = top_k_rerank
-        self.reranker = BM25Reranker()
-        self.retriever = ChromaRetriever(chroma_collection)
+        # Anything with scores(query, documents) -> List[float]
+        self.reranker = reranker or BM25Reranker()
+        self.retriever = ChromaRetriever(vector_store)
+
+    async def __call__(self, state: GraphState, config: Optional[dict] = None) -> dict:
+        # On the self-correction retry the candidates of the first attempt
+        # are kept; one wider search adds only chunks not seen yet, and the
+        # whole pool is reranked against the rephrased query
+        pool = state.get("candidates")
+        retrying = pool is not None
+        pool = list(pool or [])
+        store = ChunkStore.from_config(config)
+        attempt = "retry" if retrying else "first"
+        retry_count = state.get("retry_count", 0) + 1 if retrying else 0
+        top_k = self.top_k_retrieve * RETRY_RETRIEVE_MULTIPLIER if retrying else self.top_k_retrieve
 
-    async def __call__(self, state: GraphState) -> GraphState:
         try:
-            # 1️⃣ Retrieve from Chroma
-            raw_docs = self.retriever.retrieve(
-                query=state["query"],
-                file_ids=state.get("file_ids", []),
-                top_k=self.top_k_retrieve
-            )
+            # 1️⃣ Retrieve every planner variant in one batch, then fuse the rankings
+            queries = state.get("queries") or [state["query"]]
+            with RETRIEVAL_STAGE_LATENCY.time(stage="embed", attempt=attempt):
+                query_embeddings = await self.retriever.embed(queries)
+            with RETRIEVAL_STAGE_LATENCY.time(stage="search", attempt=attempt):
+                result_lists = await self.retriever.search(
+                    query_embeddings,
+                    file_ids=state.get("file_ids", []),
+                    top_k=top_k,
+                    exclude_ids={chunk["id"] for chunk in pool},
+                )
+            fused = reciprocal_rank_fusion(result_lists, top_k)
+            store.add(fused)
+            pool.extend({"id": d["id"], "score": d["fusion_score"]} for d in fused)
 
-            texts = [d["text"] for d in raw_docs] if raw_docs else []
+            # Chunks evicted from a shared store cannot be reranked
+            ids = [c["id"] for c in pool if c["id"] in store]
 
             # 2️⃣ BM25 rerank
-            reranked_docs = self.reranker.rerank(
-                query=state["query"],
-                documents=texts,
-                top_k=self.top_k_rerank
-            )
+            with RETRIEVAL_STAGE_LATENCY.time(stage="rerank", attempt=attempt):
+                scores = self.reranker.scores(query=state["query"], documents=store.texts(ids))
+            ranked = sorted(zip(ids, scores), key=lambda x: x[1], reverse=True)[:self.top_k_rerank]
 
             return {
-                **state,
-                "documents": texts,
-                "reranked_documents": reranked_docs
+                "candidates": pool,
+                "reranked": [{"id": chunk_id, "score": score} for chunk_id, score in ranked],
+                "retry_count": retry_count,
             }
 
         except Exception as e:
             print("Retrieve + BM25 error:", e)
             return {
-                **state,
-                "documents": [],
-                "reranked_documents": []
+                "candidates": pool,
+                "reranked": [],
+                "retry_count": retry_count,
             }
@@ -2,8 +2,10 @@ from typing import TypedDict, List, Optional
 
 class GraphState(TypedDict):
     query: str
-    documents: List[str]
-    reranked_documents: List[str]
+    queries: Optional[List[str]] # planner variants; query is the first
+    # Chunks are referenced as {"id", "score"}; texts live in the request's ChunkStore
+    candidates: Optional[List[dict]] # every chunk retrieved so far, fusion scores
+    reranked: List[dict] # context for Generate, BM25 scores
     answer: Optional[str]
     supporting_facts: Optional[List[str]]
     confidence_score: Optional[float]
@@ -12,4 +14,6 @@ class GraphState(TypedDict):
     final_answer: Optional[str]
     file_ids: List[str]
     chat_history: List[object] # List[BaseMessage]
-    session_id: str
\ No newline at end of file
+    session_id: str
+    degraded: Optional[bool] # admission pressure: skip optional LLM work
+    deadline: Optional[float] # time.monotonic() by which LLM calls must finish
\ No newline at end of file
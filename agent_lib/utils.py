@@ -1,8 +1,22 @@
-from langchain_groq import ChatGroq
-from langfuse.langchain import CallbackHandler
+import asyncio
+import inspect
+import logging
 import os
+from collections import OrderedDict
+
+import numpy as np
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.embedding_cache import get_embedding_cache
+from utils.embeddings import encode_texts
+from utils.metrics import LLM_TOKENS, NODE_LATENCY, VECTOR_SEARCH_LATENCY
+
+logger = logging.getLogger(__name__)
 
 def __get_llm(model_name:str):
+    from langchain_groq import ChatGroq
+
     llm = ChatGroq(
         temperature=0.2,
         api_key=os.environ.get('GROQ_API_KEY', ''),
@@ -11,33 +25,229 @@ def __get_llm(model_name:str):
     return llm
 
 
-from typing import List, Dict, Any
+_langfuse_handler = None
+_langfuse_initialized = False
+
+
+def get_langfuse_handler():
+    """
+    Process-wide Langfuse callback handler, created on first use.
+
+    Returns None when Langfuse is not configured or fails to initialise.
+    No auth check is made; credentials problems surface in the Langfuse
+    client's own background export instead of on the request path.
+    """
+    global _langfuse_handler, _langfuse_initialized
+    if _langfuse_initialized:
+        return _langfuse_handler
+    _langfuse_initialized = True
+
+    if not (os.environ.get("LANGFUSE_PUBLIC_KEY") and os.environ.get("LANGFUSE_SECRET_KEY")):
+        logger.info("Langfuse not configured; tracing disabled")
+        return None
+    try:
+        from langfuse.langchain import CallbackHandler
+
+        _langfuse_handler = CallbackHandler(public_key=os.environ.get("LANGFUSE_PUBLIC_KEY"))
+    except Exception as e:
+        logger.warning(f"Langfuse handler unavailable: {e}")
+    return _langfuse_handler
+
+
+def flush_langfuse():
+    """Flush pending Langfuse events (called at shutdown, not per request)"""
+    if _langfuse_handler is None:
+        return
+    try:
+        from langfuse import get_client
+
+        get_client().flush()
+    except Exception as e:
+        logger.warning(f"Langfuse flush failed: {e}")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Counts LLM input/output tokens per model from usage metadata"""
+
+    def __init__(self):
+        self._models = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._models[run_id] = params.get("model") or params.get("model_name") or "unknown"
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model = self._models.pop(run_id, "unknown")
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+        if not (input_tokens or output_tokens):
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            input_tokens = token_usage.get("prompt_tokens", 0)
+            output_tokens = token_usage.get("completion_tokens", 0)
+        LLM_TOKENS.inc(input_tokens, model=model, direction="in")
+        LLM_TOKENS.inc(output_tokens, model=model, direction="out")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._models.pop(run_id, None)
+
+
+class TimedNode:
+    """Wraps a graph node and records its latency in rag_node_latency_seconds"""
+
+    def __init__(self, node):
+        self.node = node
+        self.name = node.name
+        # Forward the LangGraph-injected arguments the node asks for
+        params = inspect.signature(node).parameters
+        self._injected = [name for name in ("config", "writer") if name in params]
+
+    async def __call__(self, state, config=None, writer=None):
+        available = {"config": config, "writer": writer}
+        with NODE_LATENCY.time(node=self.name):
+            return await self.node(state, **{name: available[name] for name in self._injected})
+
+
+from typing import List, Dict, Any, Optional
+
+
+class ChunkStore:
+    """
+    Chunk texts and metadata by chunk id for one request.
+
+    Graph state carries only chunk ids and scores; Retrieve puts the
+    fetched chunks here and Generate resolves the ids it needs. The store
+    travels in config["configurable"]["chunk_store"], outside the state,
+    so texts are never copied between steps, sent to callbacks or
+    checkpointed. max_chunks bounds the store (least recently used first).
+    """
+
+    def __init__(self, max_chunks: Optional[int] = None):
+        self.max_chunks = max_chunks
+        self._chunks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def add(self, chunks: List[Dict[str, Any]]):
+        for chunk in chunks:
+            self._chunks[chunk["id"]] = {"text": chunk["text"], "metadata": chunk.get("metadata")}
+            self._chunks.move_to_end(chunk["id"])
+        if self.max_chunks:
+            while len(self._chunks) > self.max_chunks:
+                self._chunks.popitem(last=False)
+
+    def texts(self, ids: List[str]) -> List[str]:
+        """Texts for ids, in order; ids no longer held are skipped"""
+        return [self._chunks[i]["text"] for i in ids if i in self._chunks]
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._chunks
+
+    def __len__(self):
+        return len(self._chunks)
+
+    @staticmethod
+    def from_config(config: Optional[dict]) -> "ChunkStore":
+        """The request's store, or a shared bounded one when the caller passed none"""
+        store = ((config or {}).get("configurable") or {}).get("chunk_store")
+        return store if store is not None else _shared_chunk_store
+
+
+_shared_chunk_store = ChunkStore(max_chunks=10000)
+
 
 class ChromaRetriever:
-    def __init__(self, collection):
-        self.collection = collection
+    """
+    Embeds the query locally and searches the selected files.
+
+    Small selections (the usual one to three documents) are searched
+    exactly against the in-memory embedding cache; anything else, or any
+    cache failure, goes to the configured VectorStore.
 
-    def retrieve(
+    Query embeddings are memoized (LRU) so a query seen again, e.g. an
+    unchanged variant on the self-correction retry, is not re-encoded.
+    """
+
+    def __init__(self, vector_store, cache=None, max_cached_queries: int = 256):
+        self.vector_store = vector_store
+        self.cache = cache or get_embedding_cache()
+        self.max_cached_queries = max_cached_queries
+        self._query_embeddings: "OrderedDict[str, Any]" = OrderedDict()
+
+    async def embed(self, queries: List[str]):
+        """Embed queries in one batch, skipping ones embedded recently"""
+        # Keep the hits here: other requests may evict them while this one awaits the encoder
+        found = {q: self._query_embeddings[q] for q in queries if q in self._query_embeddings}
+        missing = [q for q in dict.fromkeys(queries) if q not in found]
+        if missing:
+            found.update(zip(missing, await asyncio.to_thread(encode_texts, missing)))
+        for query, embedding in found.items():
+            self._query_embeddings[query] = embedding
+            self._query_embeddings.move_to_end(query)
+        while len(self._query_embeddings) > self.max_cached_queries:
+            self._query_embeddings.popitem(last=False)
+        return np.stack([found[q] for q in queries])
+
+    async def retrieve(
         self,
         query: str,
         file_ids: List[str],
         top_k: int = 12
     ) -> List[Dict[str, Any]]:
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=top_k,
-            where={"file_id": {"$in": file_ids}}
-        )
-
-        docs = []
-        if not results or not results.get("ids"):
-            return docs
-
-        for i in range(len(results["ids"][0])):
-            docs.append({
-                "id": results["ids"][0][i],
-                "text": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i]
-            })
-
-        return docs
+        results = await self.retrieve_many([query], file_ids, top_k)
+        return results[0] if results else []
+
+    async def retrieve_many(
+        self,
+        queries: List[str],
+        file_ids: List[str],
+        top_k: int = 12,
+        exclude_ids=None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Embed all queries in one batch and search them in one store call"""
+        return await self.search(await self.embed(queries), file_ids, top_k, exclude_ids)
+
+    async def search(
+        self,
+        query_embeddings,
+        file_ids: List[str],
+        top_k: int = 12,
+        exclude_ids=None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        top_k chunks per query embedding. Chunks in exclude_ids are left
+        out; the search over-fetches by their number instead of issuing a
+        second query.
+        """
+        exclude_ids = set(exclude_ids or ())
+        fetch_k = top_k + len(exclude_ids)
+        results = None
+        if self.cache.enabled and file_ids:
+            try:
+                with VECTOR_SEARCH_LATENCY.time(strategy="cache"):
+                    results = await self.cache.search(query_embeddings, file_ids, fetch_k, self.vector_store)
+            except Exception as e:
+                logger.warning(f"Embedding cache search failed, using the vector store: {e}")
+        if results is None:
+            results = await self.vector_store.query(query_embeddings, file_ids, fetch_k)
+        if exclude_ids:
+            results = [[c for c in chunks if c["id"] not in exclude_ids][:top_k] for chunks in results]
+        return results
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], top_k: int, k: int = 60) -> List[Dict[str, Any]]:
+    """
+    Merge ranked result lists into one, deduplicated by chunk id.
+
+    Each chunk scores sum(1 / (k + rank)) over the lists it appears in, so
+    chunks found by several query variants rise to the top.
+    """
+    scores, chunks = {}, {}
+    for results in result_lists:
+        for rank, chunk in enumerate(results, start=1):
+            scores[chunk["id"]] = scores.get(chunk["id"], 0.0) + 1.0 / (k + rank)
+            chunks.setdefault(chunk["id"], chunk)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [{**chunks[chunk_id], "fusion_score": scores[chunk_id]} for chunk_id in ranked]
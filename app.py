@@ -6,31 +6,36 @@ if sys.platform == 'win32':
 import json
 import logging
 import os
-import re
-import tempfile
+import time
 from contextlib import asynccontextmanager
 from typing import List, Optional
 
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import Body, Depends, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import BackgroundTasks, Body, Depends, FastAPI, File, Form, HTTPException, Query, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from langchain_groq import ChatGroq
-from langfuse.langchain import CallbackHandler
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 
-from agent_lib.graph import build_graph
+# agent_lib (LangGraph, LangChain, Groq) and the ingestion dependencies are
+# imported on first use / during warm-up so the process answers /health fast.
 from ingestion_utils import (
+    adelete_objects_from_b2,
+    aupload_file_to_b2,
     chunk_and_embed,
-    download_file_from_b2,
-    extract_text_and_images,
-    get_b2_resource,
-    upload_file_to_b2,
+    get_b2_client,
+    iter_text_and_images,
+    spool_upload,
 )
+from ingestion_utils.extraction import shutdown_extraction_pool
 from utils import DatabaseManager
-from utils.database import collection
+from utils.admission import AdmissionController
+from utils.catalog import FileCatalog
+from utils.embeddings import get_embedding_model
+from utils.metrics import CHAT_LATENCY, TIME_TO_FIRST_TOKEN, record_cache, render_latest
+from utils.single_flight import SingleFlight
 from utils.utils import create_jwt_token, verify_jwt_token
 
 load_dotenv()
@@ -39,6 +44,79 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 db_manager = DatabaseManager()
+file_catalog = FileCatalog(db_manager)
+
+# Preload the embedding model and compile the graph in the background at
+# start-up; when disabled they are built by the first request that needs them.
+WARMUP_MODELS = os.getenv("WARMUP_MODELS", "true").lower() == "true"
+
+# Coalesce concurrent identical questions (same normalized query and file
+# set, no chat history yet) onto one graph run whose stream is fanned out
+CHAT_COALESCING = os.getenv("CHAT_COALESCING", "true").lower() == "true"
+
+# Per-client rate limits, concurrency slots and bounded wait queues; see README
+chat_admission = AdmissionController.from_env(
+    "chat", max_concurrency=32, max_queue=64, queue_timeout=10.0, rate_per_minute=60, burst=10
+)
+ingest_admission = AdmissionController.from_env(
+    "ingest", max_concurrency=2, max_queue=8, queue_timeout=60.0, rate_per_minute=10, burst=5
+)
+# Above this chat pressure the planner rewrite and the retry loop are skipped
+SHED_PRESSURE = float(os.getenv("ADMISSION_SHED_PRESSURE", "0.8"))
+# Ids per bulk delete when purging documents
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+# Budget for all LLM calls of one chat request (planner, generate, retry)
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", "60"))
+
+_graph = None
+_warmup_task = None
+chat_flights = SingleFlight()
+
+_TEXT_EVENT_PREFIX = 'data: {"event": "text"'
+
+
+def coalescing_key(query: str, file_ids: List[str]):
+    return " ".join(query.lower().split()), frozenset(file_ids)
+
+
+def get_graph():
+    """Compile the RAG graph once per process"""
+    global _graph
+    if _graph is None:
+        from agent_lib.graph import build_graph
+        from agent_lib.llm import LLMRouter
+
+        llm = LLMRouter.from_env(
+            "planner", ["moonshotai/kimi-k2-instruct-0905", "llama-3.1-8b-instant"], timeout=5.0
+        )
+        _graph = build_graph(
+            pg_pool=db_manager.connection_pool,
+            llm=llm,
+            vector_store=db_manager.vector_store,
+        )
+    return _graph
+
+
+async def warm_up():
+    """Open the vector store and, if enabled, preload models off the critical path"""
+    await db_manager.initialize_vector_store()
+    if WARMUP_MODELS:
+        await asyncio.to_thread(get_embedding_model)
+        logger.info("Embedding model loaded")
+        await asyncio.to_thread(get_graph)
+        logger.info("Graph compiled")
+        await asyncio.to_thread(get_b2_client)
+        logger.info("B2 client created")
+    logger.info("Warm-up complete")
+
+
+async def ensure_ready():
+    """Wait for warm-up; raise 503 if it failed"""
+    try:
+        await asyncio.shield(_warmup_task)
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        raise HTTPException(status_code=503, detail="Service not ready")
 
 # ─── Request / Response Schemas ──────────────────────────────────────────────
 
@@ -47,30 +125,43 @@ class ChatCompletionRequest(BaseModel):
     chat_session: str
     source: List[str]
 
+class PurgeDocumentsRequest(BaseModel):
+    file_ids: List[str] = Field(..., min_length=1, max_length=10000)
+
 # ─── Lifespan ────────────────────────────────────────────────────────────────
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up application...")
 
-    if not db_manager.initialize_pool(min_conn=2, max_conn=20):
+    if not db_manager.initialize_pool():
         logger.error("Failed to initialize database connection pool")
         raise Exception("Database initialization failed")
 
-    await db_manager.connection_pool.open()
-    logger.info("Database pool opened")
+    await db_manager.open_pool()
+    logger.info("Database pools opened")
 
     if not await db_manager.create_content_table():
         logger.error("Failed to create content table")
         raise Exception("Table creation failed")
 
     logger.info("Database initialized successfully")
+
+    await file_catalog.start()
+
+    global _warmup_task
+    _warmup_task = asyncio.create_task(warm_up())
     yield
 
     logger.info("Shutting down application...")
-    if db_manager.connection_pool:
-        await db_manager.connection_pool.close()
-        logger.info("Database connection pool closed")
+    _warmup_task.cancel()
+    await file_catalog.stop()
+    await db_manager.close_pool()
+    shutdown_extraction_pool()
+
+    from agent_lib import flush_langfuse
+
+    flush_langfuse()
     logger.info("Application shutdown complete")
 
 # ─── App Setup ───────────────────────────────────────────────────────────────
@@ -121,99 +212,222 @@ async def health_check():
     """Simple health check endpoint."""
     return {"status": "healthy"}
 
+
+@app.get("/ready", tags=["system"])
+async def readiness_check():
+    """Readiness: 200 once the vector store is open and warm-up has finished."""
+    if _warmup_task is None or not _warmup_task.done():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    if _warmup_task.cancelled() or _warmup_task.exception():
+        return JSONResponse(status_code=503, content={"status": "failed"})
+    return {"status": "ready"}
+
+
+@app.get("/v1/pool-stats", tags=["system"])
+async def pool_stats(client: str = Depends(verify_jwt_token)):
+    """Database pool size, saturation and wait-time figures."""
+    return db_manager.get_pool_stats()
+
+
+@app.get("/metrics", tags=["system"], response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text-format metrics for this worker."""
+    return PlainTextResponse(
+        render_latest(db_manager.get_pool_stats()),
+        media_type="text/plain; version=0.0.4",
+    )
+
 # ─── Documents ───────────────────────────────────────────────────────────────
 
 @app.get("/v1/documents", tags=["documents"])
-async def list_documents(client: str = Depends(verify_jwt_token)):
-    """List all uploaded documents."""
-    documents = await db_manager.list_all_files()
-    return {"documents": documents}
+async def list_documents(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    client: str = Depends(verify_jwt_token),
+):
+    """
+    List uploaded documents, newest first.
+
+    Pass limit for keyset pagination; the response then carries
+    next_cursor, to be sent back as cursor for the following page.
+    """
+    try:
+        documents, next_cursor = await file_catalog.list_files(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing documents: {e}")
+        documents, next_cursor = [], None
+    if limit is None:
+        return {"documents": documents}
+    return {"documents": documents, "next_cursor": next_cursor}
+
+
+async def purge_documents(file_ids: List[str]):
+    """Delete documents from the vector store, Postgres and B2, PURGE_BATCH_SIZE ids at a time"""
+    bucket_name = os.getenv("B2_BUCKET_NAME")
+    for start in range(0, len(file_ids), PURGE_BATCH_SIZE):
+        batch = file_ids[start:start + PURGE_BATCH_SIZE]
+        try:
+            deleted = await db_manager.delete_files(batch)
+            object_keys = [row["object_key"] for row in deleted]
+            if bucket_name and object_keys:
+                await adelete_objects_from_b2(get_b2_client(), bucket_name, object_keys)
+            logger.info(f"Purged {len(deleted)} of {len(batch)} documents")
+        except Exception as e:
+            logger.error(f"Purge of {len(batch)} documents failed: {e}")
+
+
+@app.delete("/v1/documents/{file_id}", status_code=202, tags=["documents"])
+async def delete_document(
+    file_id: str,
+    background_tasks: BackgroundTasks,
+    client: str = Depends(verify_jwt_token),
+):
+    """Delete a document, its chunks and its B2 object (in the background)."""
+    await ensure_ready()
+    if await db_manager.get_file_by_id(file_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    background_tasks.add_task(purge_documents, [file_id])
+    return {"status": "accepted", "file_ids": [file_id]}
+
+
+@app.post("/v1/documents/purge", status_code=202, tags=["documents"])
+async def purge_documents_endpoint(
+    request: PurgeDocumentsRequest,
+    background_tasks: BackgroundTasks,
+    client: str = Depends(verify_jwt_token),
+):
+    """Delete many documents by id in bulk; unknown ids are ignored."""
+    await ensure_ready()
+    file_ids = list(dict.fromkeys(request.file_ids))
+    background_tasks.add_task(purge_documents, file_ids)
+    return {"status": "accepted", "file_ids": file_ids}
 
 
 @app.post("/v1/process-document", response_class=JSONResponse, tags=["documents"])
 async def upload_to_b2(
     file: UploadFile = File(...),
     object_name: Optional[str] = Form(None),
-    b2_resource=Depends(get_b2_resource),
+    b2_client=Depends(get_b2_client),
     extract_images: Optional[bool] = True,
     client: str = Depends(verify_jwt_token),
 ):
-    """Upload a document to B2, download it, extract text, chunk and embed."""
+    """Spool the upload to disk, upload it to B2 and process the local copy concurrently."""
     bucket_name = os.getenv("B2_BUCKET_NAME")
     if not bucket_name:
         raise HTTPException(status_code=500, detail="B2_BUCKET_NAME not set in environment")
 
-    # Save upload to temp file
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        temp_file.write(await file.read())
-        temp_file.flush()
-        temp_file_path = temp_file.name
+    await ensure_ready()
 
-        if not object_name:
-            object_name = file.filename
+    # Extraction and embedding are CPU-heavy; bound concurrent jobs
+    ingest_admission.check_rate(client)
+    slot = await ingest_admission.acquire()
+    try:
+        return await _process_upload(file, object_name, b2_client, extract_images, bucket_name)
+    finally:
+        ingest_admission.release(slot)
 
-        upload_success = upload_file_to_b2(
-            b2_resource=b2_resource,
-            local_file_path=temp_file_path,
-            bucket_name=bucket_name,
-            object_name=object_name,
-        )
-        logger.info(f"File uploaded to {bucket_name}/{object_name}")
-        if not upload_success:
-            raise HTTPException(status_code=500, detail="Failed to upload file to B2")
-
-    # Download back for processing
-    download_file_path = f"internal_{object_name}"
-    download_file = download_file_from_b2(
-        b2_resource=b2_resource,
-        bucket_name=bucket_name,
-        object_name=object_name,
-        local_file_path=download_file_path,
-    )
 
-    content_id = await db_manager.save_content_db(
-        file_name=download_file_path,
-        object_key=object_name,
-    )
-    logger.info(f"Download logged to database with ID: {content_id}")
+async def _process_upload(file: UploadFile, object_name: Optional[str], b2_client,
+                          extract_images: bool, bucket_name: str) -> JSONResponse:
+    if not object_name:
+        object_name = file.filename
+    file_name = f"internal_{object_name}"
 
-    if not download_file:
-        raise HTTPException(
-            status_code=500,
-            detail="File uploaded to B2, but failed to download for processing",
-        )
+    # Stream the upload to a temp file in chunks, hashing as we go
+    local_file_path, content_hash, size = await spool_upload(file)
+    logger.info(f"Spooled {object_name} ({size} bytes, sha256={content_hash[:12]})")
 
+    upload_task = None
     try:
-        result = extract_text_and_images(
-            downloaded_file_path=download_file_path,
-            extract_images=extract_images,
+        upload_task = asyncio.create_task(
+            aupload_file_to_b2(
+                b2_client=b2_client,
+                local_file_path=local_file_path,
+                bucket_name=bucket_name,
+                object_name=object_name,
+            )
         )
-        chunk_and_embed(
-            documents=result["text"],
-            file_id=content_id,
-            database_manager=db_manager,
+
+        # Same object name, same id: the earlier upload's chunks stay searchable
+        # until this one is stored, and are kept if it fails
+        previous = await db_manager.get_file_by_id(db_manager.content_id(object_name))
+        previous_chunk_ids = set(await db_manager.chunk_ids(previous["id"])) if previous else set()
+
+        content_id = await db_manager.save_content_db(
+            file_name=file_name,
+            object_key=object_name,
+            content_hash=content_hash,
         )
-        logger.info("Document chunked and embedded successfully")
+        if content_id is None:
+            raise HTTPException(status_code=500, detail="Failed to record the upload")
+        logger.info(f"Upload logged to database with ID: {content_id}")
+
+        async def process_local_copy():
+            await chunk_and_embed(
+                documents=iter_text_and_images(local_file_path, extract_images),
+                file_id=content_id,
+                database_manager=db_manager,
+            )
 
-        return JSONResponse(
-            status_code=200,
-            content={
-                "status": "success",
-                "message": f"File uploaded to {bucket_name}/{object_name} and processed",
-                "file_path": download_file,
-            },
+        upload_success, processing_error = await asyncio.gather(
+            upload_task, process_local_copy(), return_exceptions=True
         )
-    except Exception as e:
-        logger.error(f"Document processing error: {e}")
+    finally:
+        if upload_task is not None:
+            # If a step before the gather raised, the upload is still running on
+            # a worker thread (which cannot be cancelled) and reading the spooled
+            # file: wait for it, and collect its outcome, before removing the file
+            await asyncio.gather(upload_task, return_exceptions=True)
+        os.remove(local_file_path)
+
+    if upload_success is not True:
+        logger.error(f"B2 upload failed for {object_name}: {upload_success}")
+        if previous_chunk_ids:
+            await _restore_previous_upload(content_id, previous, previous_chunk_ids)
+        else:
+            await db_manager.delete_file(content_id)
+        raise HTTPException(status_code=500, detail="Failed to upload file to B2")
+    logger.info(f"File uploaded to {bucket_name}/{object_name}")
+
+    if processing_error is not None:
+        logger.error(f"Document processing error: {processing_error}")
+        if previous_chunk_ids:
+            await _restore_previous_upload(content_id, previous, previous_chunk_ids)
         return JSONResponse(
             status_code=206,
             content={
                 "status": "partial_success",
-                "message": f"File uploaded but processing failed: {str(e)}",
-                "file_path": download_file_path,
+                "message": f"File uploaded but processing failed: {str(processing_error)}",
+                "file_path": f"{bucket_name}/{object_name}",
             },
         )
 
+    if previous_chunk_ids:
+        await db_manager.delete_chunk_ids(content_id, list(previous_chunk_ids))
+    logger.info("Document chunked and embedded successfully")
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": f"File uploaded to {bucket_name}/{object_name} and processed",
+            "file_path": f"{bucket_name}/{object_name}",
+            "content_hash": content_hash,
+        },
+    )
+
+async def _restore_previous_upload(content_id: str, previous: dict, previous_chunk_ids: set):
+    """Drop the chunks a failed re-upload stored, keeping the earlier upload's"""
+    new_chunk_ids = [i for i in await db_manager.chunk_ids(content_id) if i not in previous_chunk_ids]
+    await db_manager.delete_chunk_ids(content_id, new_chunk_ids)
+    if previous.get("content_hash"):
+        await db_manager.save_content_db(
+            file_name=previous["file_name"], object_key=previous["object_key"],
+            content_hash=previous["content_hash"],
+        )
+    logger.info(f"Kept the earlier upload of {previous['object_key']}")
+
 # ─── Chat ────────────────────────────────────────────────────────────────────
 
 @app.post("/v1/chat-completion", tags=["chat"])
@@ -222,8 +436,9 @@ async def chat_with_context(
     client: str = Depends(verify_jwt_token),
 ):
     """Stream a chat completion response for the given query and source documents."""
+    request_started = time.perf_counter()
     try:
-        file_map = await db_manager.get_file_ids_by_names(request.source)
+        file_map = await file_catalog.get_file_ids_by_names(request.source)
 
         if not file_map:
             raise HTTPException(status_code=404, detail="No matching files found")
@@ -237,36 +452,28 @@ async def chat_with_context(
 
         file_ids = list(file_map.values())
 
-        groq_api_key = os.environ["GROQ_API_KEY"]
-        llm = ChatGroq(
-            temperature=0.2,
-            api_key=groq_api_key,
-            model_name="moonshotai/kimi-k2-instruct-0905",
-        )
+        await ensure_ready()
+        chat_admission.check_rate(client)
+        degraded = chat_admission.pressure() >= SHED_PRESSURE
 
-        langfuse_handler = CallbackHandler(
-            secret_key=os.environ.get("LANGFUSE_SECRET_KEY"),
-            public_key=os.environ.get("LANGFUSE_PUBLIC_KEY"),
-            host=os.environ.get("LANGFUSE_HOST"),
-        )
-        try:
-            langfuse_handler.auth_check()
-        except:
-            pass
+        from agent_lib import ChunkStore, MetricsCallbackHandler, get_langfuse_handler
 
-        graph = build_graph(
-            pg_pool=db_manager.connection_pool,
-            llm=llm,
-            chroma_collection=collection,
-        )
+        callbacks = [MetricsCallbackHandler()]
+        langfuse_handler = get_langfuse_handler()
+        if langfuse_handler:
+            callbacks.append(langfuse_handler)
 
-        async def generate_stream():
+        graph = await asyncio.to_thread(get_graph)
+
+        async def produce(flight=None):
             try:
                 inputs = {
                     "query": request.query,
                     "file_ids": file_ids,
                     "chat_session": request.chat_session,
                     "session_id": request.chat_session,
+                    "degraded": degraded,
+                    "deadline": time.monotonic() + CHAT_DEADLINE,
                 }
 
                 final_answer = ""
@@ -274,72 +481,28 @@ async def chat_with_context(
                 confidence_score = None
                 sources = request.source
 
-                # State machine for stripping JSON scaffolding from streamed tokens.
-                # BUFFERING: accumulate tokens until we find the "answer" value opening quote
-                # STREAMING: emit only the answer text to the client
-                # DONE: answer value closed, skip remaining JSON tokens
-                stream_state = "BUFFERING"
-                json_buffer = ""
-                escape_next = False
-
-                async for event in graph.astream_events(
-                    inputs, 
-                    version="v2", 
-                    config={"callbacks": [langfuse_handler]}
+                # Generate streams only answer text on the custom channel;
+                # updates mark node boundaries. Tokens from a retry's second
+                # generate pass are not streamed, its result arrives in final_response.
+                answer_streamed = False
+                async for mode, chunk in graph.astream(
+                    inputs,
+                    config={"callbacks": callbacks, "configurable": {"chunk_store": ChunkStore()}},
+                    stream_mode=["custom", "updates"],
                 ):
-                    kind = event["event"]
-
-                    if kind == "on_chat_model_stream":
-                        content = event["data"]["chunk"].content
-                        if not content:
-                            continue
-
-                        if stream_state == "BUFFERING":
-                            json_buffer += content
-                            match = re.search(r'"answer"\s*:\s*"', json_buffer)
-                            if match:
-                                stream_state = "STREAMING"
-                                remaining = json_buffer[match.end():]
-                                json_buffer = ""
-                                answer_chunk = ""
-                                for ch in remaining:
-                                    if escape_next:
-                                        answer_chunk += ch
-                                        escape_next = False
-                                    elif ch == '\\':
-                                        escape_next = True
-                                        answer_chunk += ch
-                                    elif ch == '"':
-                                        stream_state = "DONE"
-                                        break
-                                    else:
-                                        answer_chunk += ch
-                                if answer_chunk:
-                                    yield f"data: {json.dumps({'event': 'text', 'data': answer_chunk})}\n\n"
-                                    final_answer += answer_chunk
-
-                        elif stream_state == "STREAMING":
-                            answer_chunk = ""
-                            for ch in content:
-                                if escape_next:
-                                    answer_chunk += ch
-                                    escape_next = False
-                                elif ch == '\\':
-                                    escape_next = True
-                                    answer_chunk += ch
-                                elif ch == '"':
-                                    stream_state = "DONE"
-                                    break
-                                else:
-                                    answer_chunk += ch
-                            if answer_chunk:
-                                yield f"data: {json.dumps({'event': 'text', 'data': answer_chunk})}\n\n"
-                                final_answer += answer_chunk
-
-                        # DONE state: skip remaining JSON tokens silently
-
-                    elif kind == "on_chain_end" and event["name"] == "generate":
-                        output = event["data"].get("output")
+                    if mode == "custom":
+                        if not answer_streamed:
+                            yield f"data: {json.dumps(chunk)}\n\n"
+                            final_answer += chunk["data"]
+
+                    elif "set_chat_history" in chunk:
+                        # A run that read no history gives an answer any fresh session can share
+                        if flight is not None:
+                            flight.decide(not (chunk["set_chat_history"] or {}).get("chat_history"))
+
+                    elif "generate" in chunk:
+                        answer_streamed = True
+                        output = chunk["generate"]
                         if output and isinstance(output, dict):
                             if "answer" in output:
                                 final_answer = output["answer"]
@@ -357,16 +520,89 @@ async def chat_with_context(
                         "confidence_score": confidence_score,
                     },
                 }
+                if flight is not None:
+                    flight.result = final_response["data"]
                 yield f"data: {json.dumps(final_response)}\n\n"
                 yield "data: [DONE]\n\n"
 
             except Exception as e:
                 logger.error(f"Streaming error: {e}")
                 yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+        # Only runs that call the LLM take a concurrency slot; the slot is
+        # held until the graph run finishes
+        slot = None
+        producer_started = False
+
+        def release_slot():
+            nonlocal slot
+            if slot is not None:
+                chat_admission.release(slot)
+                slot = None
+
+        async def produce_admitted(flight=None):
+            nonlocal producer_started
+            producer_started = True
+            try:
+                async for chunk in produce(flight):
+                    yield chunk
             finally:
-                langfuse_handler.flush()
+                release_slot()
+
+        # Identical questions on fresh sessions share one graph run. The run
+        # finds out from its own history load whether it may be shared, so
+        # only a request about to join one checks its session's history
+        flight, leader = None, True
+        if CHAT_COALESCING:
+            key = coalescing_key(request.query, file_ids)
+            running = chat_flights.get(key)
+            if running is None:
+                slot = await chat_admission.acquire()
+                flight = chat_flights.start(key, produce_admitted)
+                # The run outlives the leader's connection while followers
+                # listen; the slot goes with the run (also if it is cancelled
+                # before it starts)
+                flight.task.add_done_callback(lambda _task: release_slot())
+            elif await running.wait_joinable() and not await db_manager.has_chat_history(request.chat_session):
+                flight, leader = chat_flights.follow(running), False
+        if flight is not None:
+            record_cache("chat_single_flight", hit=not leader)
+            stream = flight.listen()
+        else:
+            slot = await chat_admission.acquire()
+            stream = produce_admitted()
 
-        return StreamingResponse(generate_stream(), media_type="text/event-stream")
+        async def generate_stream():
+            first_token = True
+            try:
+                async for chunk in stream:
+                    if first_token and chunk.startswith(_TEXT_EVENT_PREFIX):
+                        TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - request_started)
+                        first_token = False
+                    yield chunk
+
+                # The shared run only stored the leader's session
+                if not leader and flight.result:
+                    try:
+                        await db_manager.append_chat_history(
+                            request.chat_session, request.query, flight.result["answer"]
+                        )
+                    except Exception as e:
+                        logger.warning(f"Could not store chat history for {request.chat_session}: {e}")
+            finally:
+                CHAT_LATENCY.observe(time.perf_counter() - request_started)
+
+        def release_unstarted():
+            # A stream never iterated (client gone before the first read)
+            # never runs produce_admitted, which otherwise frees the slot
+            if not producer_started:
+                release_slot()
+
+        return StreamingResponse(
+            generate_stream(),
+            media_type="text/event-stream",
+            background=BackgroundTask(release_unstarted) if flight is None else None,
+        )
 
     except HTTPException:
         raise
@@ -378,4 +614,11 @@ async def chat_with_context(
 # ─── Entry Point ─────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="127.0.0.1", port=8000, loop="none")
+    uvicorn.run(
+        "app:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        # On Windows keep the selector loop policy set at the top of this file
+        loop="none" if sys.platform == "win32" else "auto",
+    )
@@ -0,0 +1 @@
+"""Offline benchmark and load-test harness (see bench/run.py)."""
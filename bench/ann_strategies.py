@@ -0,0 +1,187 @@
+"""
+Filtered vector search strategies at different corpus sizes.
+
+Builds a synthetic corpus (clustered, L2-normalized vectors grouped into
+files) in an in-memory Chroma collection and, for selections of 1..N files,
+compares:
+
+    ann_filtered          one collection, HNSW query with a file_id $in filter
+    exact_chroma          file_id pre-filter (collection.get) + NumPy brute force
+    exact_in_memory       brute force over already-loaded selection embeddings
+                          (the cost of pgvector's exact path or a warm cache)
+    per_file_collections  one collection per file, results merged by distance
+                          (CHROMA_PARTITION=file)
+    auto                  what VectorStore.query does: exact_chroma up to
+                          EXACT_SEARCH_MAX_CHUNKS selected chunks, else ann_filtered
+
+Reports p50/p95 latency and recall@k against exact results.
+
+    python -m bench.ann_strategies --sizes 1000 100000 1000000 --output ann.json
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from bench.run import summarize
+from utils.vector_store import EXACT_SEARCH_MAX_CHUNKS, ChromaVectorStore, exact_top_k
+
+logger = logging.getLogger("bench")
+
+STRATEGIES = ("ann_filtered", "exact_chroma", "exact_in_memory", "per_file_collections", "auto")
+
+
+def make_corpus(n_chunks: int, chunks_per_file: int, dim: int, seed: int = 0):
+    """Vectors drawn around a few topic centroids per file, normalized like the app's embeddings"""
+    rng = np.random.default_rng(seed)
+    n_files = max(1, n_chunks // chunks_per_file)
+    file_of = np.repeat(np.arange(n_files), chunks_per_file)[:n_chunks]
+    file_of = np.concatenate([file_of, np.full(n_chunks - len(file_of), n_files - 1)])
+
+    centroids = rng.normal(size=(n_files * 4, dim)).astype(np.float32)
+    topic = file_of * 4 + rng.integers(0, 4, size=n_chunks)
+    vectors = centroids[topic] + 0.8 * rng.normal(size=(n_chunks, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, file_of, n_files
+
+
+def _add_batched(client, collection, ids, vectors, metadatas):
+    batch = client.get_max_batch_size()
+    for start in range(0, len(ids), batch):
+        collection.add(
+            ids=ids[start:start + batch],
+            embeddings=vectors[start:start + batch],
+            metadatas=metadatas[start:start + batch],
+        )
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run_size(client, n_chunks, args):
+    vectors, file_of, n_files = make_corpus(n_chunks, args.chunks_per_file, args.dim, seed=n_chunks)
+    ids = [f"c{i}" for i in range(n_chunks)]
+    metadatas = [{"file_id": f"f{f}"} for f in file_of]
+
+    collection = client.create_collection(f"bench_{n_chunks}")
+    _, build_ms = _timed(lambda: _add_batched(client, collection, ids, vectors, metadatas))
+    logger.info(f"{n_chunks} chunks / {n_files} files indexed in {build_ms / 1000:.1f}s")
+
+    rng = np.random.default_rng(1)
+    selections = sorted({min(n, n_files) for n in args.select_files})
+    per_file = {}
+    results = []
+    for n_selected in selections:
+        selected = rng.choice(n_files, size=n_selected, replace=False)
+        file_ids = [f"f{f}" for f in selected]
+        rows = np.flatnonzero(np.isin(file_of, selected))
+        matrix = vectors[rows]
+
+        for f in selected:
+            if f not in per_file:
+                part = np.flatnonzero(file_of == f)
+                per_file[f] = client.create_collection(f"bench_{n_chunks}_f{f}")
+                _add_batched(client, per_file[f], [ids[i] for i in part], vectors[part], [metadatas[i] for i in part])
+
+        # Queries land near chunks of the selected files, as real questions about them do
+        targets = rng.choice(rows, size=args.queries)
+        queries = vectors[targets] + 0.3 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        where = {"file_id": {"$in": file_ids}}
+
+        def ann_filtered(q):
+            res = collection.query(query_embeddings=q[None], n_results=args.top_k, where=where, include=[])
+            return res["ids"][0]
+
+        def exact_chroma(q):
+            got = collection.get(where=where, include=["embeddings"])
+            emb = np.asarray(got["embeddings"], dtype=np.float32).reshape(len(got["ids"]), -1)
+            order, _ = exact_top_k(emb, q[None], args.top_k, "l2")[0]
+            return [got["ids"][i] for i in order]
+
+        def exact_in_memory(q):
+            order, _ = exact_top_k(matrix, q[None], args.top_k, "l2")[0]
+            return [ids[rows[i]] for i in order]
+
+        def per_file_collections(q):
+            merged = []
+            for f in selected:
+                res = per_file[f].query(
+                    query_embeddings=q[None],
+                    n_results=args.top_k,
+                    include=["distances"],
+                )
+                merged.extend(zip(res["distances"][0], res["ids"][0]))
+            return [chunk_id for _, chunk_id in sorted(merged)[: args.top_k]]
+
+        def auto(q):
+            return exact_chroma(q) if len(rows) <= args.exact_max_chunks else ann_filtered(q)
+
+        functions = {
+            "ann_filtered": ann_filtered,
+            "exact_chroma": exact_chroma,
+            "exact_in_memory": exact_in_memory,
+            "per_file_collections": per_file_collections,
+            "auto": auto,
+        }
+        truth = [set(exact_in_memory(q)) for q in queries]
+        for name in args.strategies:
+            latencies, recalls = [], []
+            for q, expected in zip(queries, truth):
+                found, ms = _timed(lambda: functions[name](q))
+                latencies.append(ms)
+                recalls.append(len(expected.intersection(found)) / len(expected))
+            results.append({
+                "chunks": n_chunks,
+                "files": n_files,
+                "selected_files": n_selected,
+                "selected_chunks": int(len(rows)),
+                "strategy": name,
+                "latency_ms": summarize(latencies),
+                "recall_at_k": float(np.mean(recalls)),
+            })
+            logger.info(
+                f"{n_chunks:>8} chunks | {n_selected:>4} files ({len(rows):>7} chunks) | {name:<20} "
+                f"p50 {results[-1]['latency_ms']['p50']:8.2f} ms | recall {results[-1]['recall_at_k']:.3f}"
+            )
+
+    for part in per_file.values():
+        client.delete_collection(part.name)
+    client.delete_collection(collection.name)
+    return {"chunks": n_chunks, "build_seconds": build_ms / 1000, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000], help="Corpus sizes in chunks")
+    parser.add_argument("--chunks-per-file", type=int, default=200)
+    parser.add_argument("--select-files", type=int, nargs="+", default=[1, 10, 100], help="Files per selection")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per selection")
+    parser.add_argument("--top-k", type=int, default=15)
+    parser.add_argument("--dim", type=int, default=int(os.getenv("EMBEDDING_DIM", "384")))
+    parser.add_argument(
+        "--exact-max-chunks", type=int,
+        default=int(EXACT_SEARCH_MAX_CHUNKS or ChromaVectorStore.exact_search_max_chunks),
+    )
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--output", default="bench_results_ann.json")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    import chromadb
+
+    client = chromadb.EphemeralClient()
+    report = {"config": vars(args), "sizes": [run_size(client, n, args) for n in args.sizes]}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
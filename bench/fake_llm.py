@@ -0,0 +1,171 @@
+"""
+Fake Groq-compatible chat completions server.
+
+Serves POST /openai/v1/chat/completions (the path the Groq SDK appends to
+GROQ_API_BASE) with configurable time to first token and tokens per second.
+A share of requests can be made slow (a latency tail, for hedging) and
+chosen models can answer 429 (for model fallback).
+Generate-style prompts get a JSON answer; planner prompts get the user's
+question echoed back as the rewritten query.
+
+Run standalone:
+    python -m bench.fake_llm --port 8100 --latency 0.3 --tps 80
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_TOKEN_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _message_text(message) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def _build_reply(messages) -> str:
+    system = " ".join(_message_text(m) for m in messages if m.get("role") == "system")
+    user = next((_message_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+    if "JSON" in system:
+        question = user.rsplit("Question:", 1)[-1].strip()
+        return json.dumps({
+            "answer": f"Based on the provided context, the answer to '{question}' "
+                      "is described in the selected documents in some detail.",
+            "supporting_facts": ["The context mentions the topic.", "The documents were searched."],
+            "confidence_score": 0.9,
+        })
+    if "query planner" in system:
+        if "one per line" in system:
+            return "\n".join([user.strip(), f"details about {user.strip()}", f"{user.strip()} explained"])
+        return user.strip()
+    return "This is a synthetic response from the benchmark LLM."
+
+
+def create_app(latency: float = 0.2, tokens_per_second: float = 50.0, slow_rate: float = 0.0,
+               slow_latency: float = 5.0, rate_limited_models=()) -> FastAPI:
+    app = FastAPI(title="Fake Groq")
+    app.state.latency = latency
+    app.state.tokens_per_second = tokens_per_second
+    app.state.slow_rate = slow_rate
+    app.state.slow_latency = slow_latency
+    app.state.rate_limited_models = set(rate_limited_models)
+    app.state.requests = 0
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        model = body.get("model", "fake-model")
+        if model in app.state.rate_limited_models:
+            return JSONResponse(
+                {"error": {"message": f"Rate limit reached for model {model}", "type": "tokens", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": "1"},
+            )
+        latency = app.state.slow_latency if random.random() < app.state.slow_rate else app.state.latency
+        reply = _build_reply(body.get("messages", []))
+        tokens = _TOKEN_RE.findall(reply)
+        prompt_tokens = sum(len(_message_text(m).split()) for m in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        delay = 1.0 / app.state.tokens_per_second if app.state.tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency + delay * len(tokens))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        def chunk(delta, finish_reason=None, extra=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if extra:
+                payload.update(extra)
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(latency)
+            yield chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                yield chunk({"content": token})
+                if delay:
+                    await asyncio.sleep(delay)
+            yield chunk({}, finish_reason="stop", extra={"x_groq": {"id": completion_id, "usage": usage}})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+class ThreadedServer:
+    """Runs a uvicorn server for an ASGI app on a background thread"""
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 8100):
+        self.host = host
+        self.port = port
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="off")
+        )
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tps", type=float, default=50.0, help="Streamed tokens per second")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests that take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--rate-limited-models", nargs="*", default=[], help="Models that always answer 429")
+    args = parser.parse_args()
+    app = create_app(args.latency, args.tps, args.slow_rate, args.slow_latency, args.rate_limited_models)
+    uvicorn.run(app, host=args.host, port=args.port)
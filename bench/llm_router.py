@@ -0,0 +1,98 @@
+"""
+Time to first token through LLMRouter against the fake Groq server.
+
+Starts bench/fake_llm.py with a latency tail (--slow-rate of requests take
+--slow-latency seconds) and streams --requests completions at
+--concurrency, once without and once with hedging. With
+--rate-limited-model the first model answers 429 so every call exercises
+the fallback to the second.
+
+    python -m bench.llm_router --requests 300 --slow-rate 0.05 --output llm_router.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from bench.fake_llm import ThreadedServer, create_app
+from bench.run import summarize
+from bench.stand_ins import free_port
+
+logger = logging.getLogger("bench")
+
+MESSAGES = [
+    ("system", "Your response MUST be a valid JSON object with an answer key."),
+    ("user", "Context:\nsome context\n\nQuestion:\nWhat is described?"),
+]
+
+
+async def run_mode(router, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    ttfts = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            first = True
+            async for chunk in router.astream(MESSAGES, deadline=time.monotonic() + args.deadline):
+                if first and chunk.content:
+                    ttfts.append(time.perf_counter() - started)
+                    first = False
+
+    results = await asyncio.gather(*(one() for _ in range(args.requests)), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    return {"ttft_seconds": summarize(ttfts), "errors": len(errors)}
+
+
+async def main_async(args):
+    from agent_lib.llm import LLMRouter
+
+    models = ["bench-primary", "bench-fallback"]
+    report = {"config": vars(args), "modes": {}}
+    for hedging in (False, True):
+        router = LLMRouter(models, timeout=args.timeout, hedging=hedging)
+        # Warm the latency window so the hedge delay comes from observed p95
+        await run_mode(router, argparse.Namespace(**{**vars(args), "requests": 50}))
+        name = "hedged" if hedging else "plain"
+        report["modes"][name] = await run_mode(router, args)
+        ttft = report["modes"][name]["ttft_seconds"]
+        logger.info(
+            f"{name:<7} TTFT p50 {ttft['p50']:.3f}s p95 {ttft['p95']:.3f}s p99 {ttft['p99']:.3f}s "
+            f"errors {report['modes'][name]['errors']}"
+        )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Usual time to first token")
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-model first-token timeout")
+    parser.add_argument("--deadline", type=float, default=30.0, help="Per-request deadline")
+    parser.add_argument("--rate-limited-model", action="store_true", help="Make the first model answer 429")
+    parser.add_argument("--output", default="bench_results_llm_router.json")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    rate_limited = ["bench-primary"] if args.rate_limited_model else []
+    server = ThreadedServer(
+        create_app(args.latency, 200.0, args.slow_rate, args.slow_latency, rate_limited), port=free_port()
+    ).start()
+    os.environ["GROQ_API_BASE"] = server.url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    try:
+        report = asyncio.run(main_async(args))
+    finally:
+        server.stop()
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
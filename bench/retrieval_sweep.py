@@ -0,0 +1,406 @@
+"""
+Retrieval quality vs latency sweep over Retrieve's parameters.
+
+Takes a labeled set of queries over a local corpus and, for every
+combination of chunk size/overlap, top_k_retrieve, top_k_rerank, reranker
+and Generate's relevance threshold, runs the real chunker, embedding
+model, vector store (in-memory Chroma plus the embedding cache),
+Retrieve and Generate nodes. Only the LLM is a deterministic stub: the
+planner keeps the query unchanged, and the answer's confidence_score is
+the share of query terms found in the context, so the threshold decides
+when the self-correction retry runs, as it does in the graph.
+
+    python -m bench.retrieval_sweep eval/dataset.json --output sweep.json
+
+Dataset (paths relative to the dataset file; pages are 1-based):
+
+    {
+      "corpus": "corpus/",
+      "queries": [
+        {
+          "query": "What was the 2023 operating margin?",
+          "files": ["annual_report.pdf"],
+          "evidence": [{"file": "annual_report.pdf", "page": 12, "text": "Operating margin rose to 14.2%"}]
+        }
+      ]
+    }
+
+"files" is the source selection sent with the chat request (default: the
+whole corpus). Each evidence passage is located in its page's text, so
+labels do not depend on the chunking: a chunk is relevant when its span
+overlaps a passage. recall@k is the share of passages covered by the
+top_k_rerank chunks passed to Generate, MRR uses the first relevant one.
+
+Reports recall@k, MRR, context tokens, retry rate and per-stage latency
+(p50/p95) for every configuration and prints the Pareto-optimal ones.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from bench.run import summarize
+
+logger = logging.getLogger("bench")
+
+RERANKERS = ("bm25", "none", "cross-encoder")
+STAGES = ("embed", "search", "rerank", "retrieve")
+
+_TERM_RE = re.compile(r"\w+")
+
+
+# ─── Corpus and labels ───────────────────────────────────────────────────────
+
+def load_corpus(directory: str):
+    """Page Documents of every PDF, .txt and .md file under directory, by file name"""
+    from langchain_core.documents import Document
+    from ingestion_utils.extraction import extract_document, page_documents
+
+    corpus = {}
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            file_name = os.path.relpath(path, directory)
+            if name.lower().endswith(".pdf"):
+                base_metadata, pages = extract_document(path)
+                docs = list(page_documents({**base_metadata, "file_name": file_name}, pages))
+            elif name.lower().endswith((".txt", ".md")):
+                with open(path, encoding="utf-8") as f:
+                    docs = [Document(page_content=f.read(), metadata={"file_name": file_name, "page": 0})]
+            else:
+                continue
+            corpus[file_name] = docs
+    return corpus
+
+
+def locate_evidence(corpus, evidence):
+    """(file, page, start, end) of an evidence passage in its page text, or None"""
+    pattern = re.compile(r"\s+".join(map(re.escape, evidence["text"].split())))
+    pages = corpus.get(evidence["file"], [])
+    if "page" in evidence:
+        pages = [doc for doc in pages if doc.metadata["page"] == evidence["page"] - 1]
+    for doc in pages:
+        match = pattern.search(doc.page_content)
+        if match:
+            return evidence["file"], doc.metadata["page"], match.start(), match.end()
+    return None
+
+
+def load_dataset(path: str):
+    with open(path) as f:
+        dataset = json.load(f)
+    corpus = load_corpus(os.path.join(os.path.dirname(os.path.abspath(path)), dataset["corpus"]))
+    queries = []
+    for item in dataset["queries"]:
+        spans = []
+        for evidence in item["evidence"]:
+            span = locate_evidence(corpus, evidence)
+            if span is None:
+                # Still counted, so recall stays honest about unreachable labels
+                logger.warning(f"Evidence not found in {evidence['file']}: {evidence['text'][:60]!r}")
+            spans.append(span)
+        queries.append({
+            "query": item["query"],
+            "files": item.get("files") or list(corpus),
+            "spans": spans,
+        })
+    return corpus, queries
+
+
+# ─── Index per chunking ──────────────────────────────────────────────────────
+
+class _ChunkCounts:
+    """The chunk counts VectorStore.choose_strategy and the embedding cache read from content"""
+
+    def __init__(self, counts):
+        self.counts = counts
+
+    async def count_chunks(self, file_ids):
+        return sum(self.counts.get(file_id, 0) for file_id in file_ids)
+
+
+class Index:
+    """One chunking of the corpus, embedded and stored like an upload"""
+
+    def __init__(self, client, corpus, max_tokens: int, overlap_tokens: int, workdir: str):
+        from ingestion_utils.chunking import TokenChunker
+        from utils.embedding_cache import EmbeddingCache
+        from utils.embeddings import encode_texts, get_embedding_model
+        from utils.vector_store import ChromaVectorStore, clean_metadata_for_chroma
+
+        self.name = f"{max_tokens}/{overlap_tokens}"
+        chunker = TokenChunker.from_model(get_embedding_model(), max_tokens, overlap_tokens)
+        self.max_tokens, self.overlap_tokens = chunker.max_tokens, chunker.overlap_tokens
+        self.spans = {}  # chunk id -> (file, page, start, end)
+        self.tokens = {}
+        counts = {}
+        collection = client.create_collection(f"sweep_{max_tokens}_{overlap_tokens}")
+
+        started = time.perf_counter()
+        for file_name, pages in corpus.items():
+            chunks = chunker.split_documents(pages)
+            if not chunks:
+                continue
+            ids = [f"{file_name}#{i}" for i in range(len(chunks))]
+            metadatas = []
+            for chunk_id, chunk in zip(ids, chunks):
+                meta = chunk.metadata
+                self.spans[chunk_id] = (file_name, meta["page"], meta["start_offset"], meta["end_offset"])
+                self.tokens[chunk_id] = meta["token_count"]
+                metadatas.append(clean_metadata_for_chroma({
+                    "file_id": file_name, "page": meta["page"], "token_count": meta["token_count"],
+                }))
+            embeddings = encode_texts([chunk.page_content for chunk in chunks], dtype="float32")
+            batch = client.get_max_batch_size()
+            for start in range(0, len(ids), batch):
+                collection.add(
+                    ids=ids[start:start + batch],
+                    embeddings=embeddings[start:start + batch],
+                    documents=[chunk.page_content for chunk in chunks[start:start + batch]],
+                    metadatas=metadatas[start:start + batch],
+                )
+            counts[file_name] = len(ids)
+        self.build_seconds = time.perf_counter() - started
+        self.store = ChromaVectorStore(_ChunkCounts(counts), collection)
+        self.cache = EmbeddingCache(directory=os.path.join(workdir, f"cache_{max_tokens}_{overlap_tokens}"))
+        logger.info(f"Chunking {self.name}: {len(self.spans)} chunks in {self.build_seconds:.1f}s")
+
+    def covered(self, chunk_ids, spans):
+        """Indexes of the evidence spans overlapped by any of chunk_ids"""
+        found = set()
+        for chunk_id in chunk_ids:
+            file_name, page, start, end = self.spans[chunk_id]
+            for i, span in enumerate(spans):
+                if span and span[0] == file_name and span[1] == page and span[2] < end and start < span[3]:
+                    found.add(i)
+        return found
+
+
+# ─── Rerankers and the stub LLM ──────────────────────────────────────────────
+
+class VectorOrder:
+    """No reranking: keep the retrieval (fusion) order"""
+
+    def scores(self, query, documents):
+        return [-float(i) for i in range(len(documents))]
+
+
+class CrossEncoderReranker:
+    """sentence-transformers CrossEncoder relevance scores"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name)
+
+    def scores(self, query, documents):
+        if not documents:
+            return []
+        return [float(s) for s in self.model.predict([(query, doc) for doc in documents])]
+
+
+def make_reranker(name: str, cross_encoder_model: str):
+    from utils.utils import BM25Reranker
+
+    if name == "bm25":
+        return BM25Reranker()
+    if name == "none":
+        return VectorOrder()
+    return CrossEncoderReranker(cross_encoder_model)
+
+
+class StubLLM:
+    """
+    Deterministic stand-in for Generate's LLM: answers with a JSON object
+    whose confidence_score is the share of query terms present in the context.
+    """
+
+    async def astream(self, messages, config=None, deadline=None):
+        from langchain_core.messages import AIMessageChunk
+
+        prompt = messages[-1].content
+        context, _, question = prompt.partition("\n\nQuestion:\n")
+        terms = {t for t in _TERM_RE.findall(question.lower()) if len(t) > 2}
+        present = set(_TERM_RE.findall(context.lower()))
+        confidence = len(terms & present) / len(terms) if terms else 0.0
+        yield AIMessageChunk(content=json.dumps({
+            "answer": "stub", "supporting_facts": [], "confidence_score": round(confidence, 4),
+        }))
+
+
+# ─── Evaluation ──────────────────────────────────────────────────────────────
+
+def _timed(timings, stage, fn):
+    if asyncio.iscoroutinefunction(fn):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                timings[stage] += time.perf_counter() - started
+    else:
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings[stage] += time.perf_counter() - started
+    return wrapper
+
+
+async def evaluate(index: Index, queries, top_k_retrieve, top_k_rerank, reranker, threshold) -> dict:
+    from agent_lib import ChunkStore
+    from agent_lib.edges import should_retry
+    from agent_lib.nodes import Generate, Retrieve
+
+    # A fresh node per configuration so the query-embedding memo starts cold
+    retrieve = Retrieve(index.store, top_k_retrieve=top_k_retrieve, top_k_rerank=top_k_rerank, reranker=reranker)
+    retrieve.retriever.cache = index.cache
+    generate = Generate(llm=StubLLM(), relevance_threshold=threshold)
+
+    timings = defaultdict(float)
+    retriever = retrieve.retriever
+    retriever.embed = _timed(timings, "embed", retriever.embed)
+    retriever.search = _timed(timings, "search", retriever.search)
+    retrieve.reranker = SimpleNamespace(scores=_timed(timings, "rerank", reranker.scores))
+
+    latencies = defaultdict(list)
+    recalls, candidate_recalls, reciprocal_ranks, context_tokens, retries = [], [], [], [], 0
+    for item in queries:
+        timings.clear()
+        state = {"query": item["query"], "queries": [item["query"]], "file_ids": item["files"]}
+        config = {"configurable": {"chunk_store": ChunkStore()}}
+        while True:
+            started = time.perf_counter()
+            state.update(await retrieve(state, config))
+            timings["retrieve"] += time.perf_counter() - started
+            state.update(await generate(state, config))
+            if should_retry(state) != "rephrase":
+                break
+            retries += 1
+
+        ids = [chunk["id"] for chunk in state["reranked"]]
+        spans = item["spans"]
+        recalls.append(len(index.covered(ids, spans)) / len(spans))
+        candidate_recalls.append(len(index.covered([c["id"] for c in state["candidates"]], spans)) / len(spans))
+        rank = next((r for r, chunk_id in enumerate(ids, 1) if index.covered([chunk_id], spans)), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        context_tokens.append(sum(index.tokens[chunk_id] for chunk_id in ids))
+        for stage in STAGES:
+            latencies[stage].append(timings[stage] * 1000)
+
+    n = len(queries)
+    return {
+        "chunking": index.name,
+        "top_k_retrieve": top_k_retrieve,
+        "top_k_rerank": top_k_rerank,
+        "reranker": type(reranker).__name__,
+        "threshold": threshold,
+        "recall_at_k": sum(recalls) / n,
+        "candidate_recall": sum(candidate_recalls) / n,
+        "mrr": sum(reciprocal_ranks) / n,
+        "context_tokens": sum(context_tokens) / n,
+        "retry_rate": retries / n,
+        "latency_ms": {stage: summarize(latencies[stage]) for stage in STAGES},
+    }
+
+
+def pareto(rows):
+    """Mark rows no other row beats on recall, MRR, retrieve p50 and context tokens at once"""
+    def key(row):
+        return (row["recall_at_k"], row["mrr"], -row["latency_ms"]["retrieve"]["p50"], -row["context_tokens"])
+
+    keys = [key(row) for row in rows]
+    for row, own in zip(rows, keys):
+        row["pareto"] = not any(
+            all(o >= s for o, s in zip(other, own)) and other != own for other in keys
+        )
+    return rows
+
+
+def format_table(rows) -> str:
+    lines = [
+        "| chunking | retrieve k | rerank k | reranker | threshold | recall@k | MRR | ctx tokens | retry | "
+        "embed p50 | search p50 | rerank p50 | retrieve p50 / p95 (ms) |",
+        "|---|---|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for row in sorted(rows, key=lambda r: (-r["recall_at_k"], r["latency_ms"]["retrieve"]["p50"])):
+        ms = row["latency_ms"]
+        lines.append(
+            f"| {row['chunking']} | {row['top_k_retrieve']} | {row['top_k_rerank']} | {row['reranker']} | "
+            f"{row['threshold']} | {row['recall_at_k']:.3f} | {row['mrr']:.3f} | {row['context_tokens']:.0f} | "
+            f"{row['retry_rate']:.2f} | {ms['embed']['p50']:.1f} | {ms['search']['p50']:.1f} | "
+            f"{ms['rerank']['p50']:.1f} | {ms['retrieve']['p50']:.1f} / {ms['retrieve']['p95']:.1f} |"
+        )
+    return "\n".join(lines)
+
+
+async def sweep(args) -> dict:
+    import chromadb
+
+    corpus, queries = load_dataset(args.dataset)
+    logger.info(f"{len(corpus)} files, {len(queries)} labeled queries")
+    client = chromadb.EphemeralClient()
+    rerankers = {name: make_reranker(name, args.cross_encoder_model) for name in args.rerankers}
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for max_tokens in args.chunk_tokens:
+            for overlap_tokens in args.chunk_overlap:
+                if overlap_tokens >= max_tokens:
+                    continue
+                index = Index(client, corpus, max_tokens, overlap_tokens, workdir)
+                # Warm the embedding cache and the models, as a running API would be
+                await evaluate(index, queries, 15, 8, rerankers[args.rerankers[0]], 0.0)
+                for top_k_retrieve in args.top_k_retrieve:
+                    for top_k_rerank in args.top_k_rerank:
+                        if top_k_rerank > top_k_retrieve:
+                            continue
+                        for name, reranker in rerankers.items():
+                            for threshold in args.thresholds:
+                                row = await evaluate(index, queries, top_k_retrieve, top_k_rerank, reranker, threshold)
+                                row["reranker"] = name
+                                rows.append(row)
+                                logger.info(
+                                    f"{index.name:>7} k={top_k_retrieve:<3} rerank={top_k_rerank:<3} {name:<13} "
+                                    f"t={threshold:<4} recall {row['recall_at_k']:.3f} mrr {row['mrr']:.3f} "
+                                    f"retrieve p50 {row['latency_ms']['retrieve']['p50']:.1f} ms"
+                                )
+    return {"config": vars(args), "queries": len(queries), "results": pareto(rows)}
+
+
+def main(argv=None):
+    from agent_lib.nodes.generate import GENERATE_RELEVANCE_THRESHOLD
+    from agent_lib.nodes.retrieve import RERANK_TOP_K, RETRIEVE_TOP_K
+    from ingestion_utils.chunking import CHUNK_OVERLAP_TOKENS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="Labeled queries (JSON, see above)")
+    parser.add_argument("--chunk-tokens", type=int, nargs="+", default=[128, 254],
+                        help="Chunk sizes in tokens (capped at the model's max_seq_length)")
+    parser.add_argument("--chunk-overlap", type=int, nargs="+", default=[CHUNK_OVERLAP_TOKENS])
+    parser.add_argument("--top-k-retrieve", type=int, nargs="+", default=sorted({8, RETRIEVE_TOP_K, 30}))
+    parser.add_argument("--top-k-rerank", type=int, nargs="+", default=sorted({4, RERANK_TOP_K}))
+    parser.add_argument("--rerankers", nargs="+", choices=RERANKERS, default=["bm25", "none"])
+    parser.add_argument("--cross-encoder-model", default="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=sorted({0.4, GENERATE_RELEVANCE_THRESHOLD, 0.8}))
+    parser.add_argument("--all", action="store_true", help="Print every configuration, not only the Pareto front")
+    parser.add_argument("--output", default="bench_results_retrieval_sweep.json")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(sweep(args))
+    rows = report["results"] if args.all else [row for row in report["results"] if row["pareto"]]
+    print(format_table(rows))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Local stand-ins for B2 and Postgres used by the benchmark harness.
+
+- B2/S3: an in-memory moto server (`pip install "moto[server]"`)
+- Postgres: a throwaway database created on a local server and dropped
+  afterwards, with the chat history table pre-created
+"""
+import contextlib
+import logging
+import socket
+import uuid
+
+import psycopg
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+logger = logging.getLogger(__name__)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def fake_b2(bucket_name: str, port: int = None):
+    """
+    Start an in-memory S3 server and create bucket_name.
+
+    Yields the environment variables the API needs to talk to it.
+    """
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    port = port or free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    try:
+        boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id="bench",
+            aws_secret_access_key="bench",
+            region_name="us-east-1",
+        ).create_bucket(Bucket=bucket_name)
+        yield {
+            "B2_ENDPOINT_URL": endpoint,
+            "B2_BUCKET_NAME": bucket_name,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+    finally:
+        server.stop()
+
+
+@contextlib.contextmanager
+def throwaway_postgres(admin_dsn: str):
+    """
+    Create a uniquely named database on the server behind admin_dsn.
+
+    Yields the DB_* environment variables for it and drops it on exit.
+    """
+    from langchain_postgres import PostgresChatMessageHistory
+
+    db_name = f"selfrag_bench_{uuid.uuid4().hex[:8]}"
+    with psycopg.connect(admin_dsn, autocommit=True) as admin:
+        admin.execute(f'CREATE DATABASE "{db_name}"')
+    logger.info(f"Created throwaway database {db_name}")
+
+    bench_dsn = make_conninfo(admin_dsn, dbname=db_name)
+    try:
+        with psycopg.connect(bench_dsn) as conn:
+            PostgresChatMessageHistory.create_tables(conn, "chat_history")
+
+        params = conninfo_to_dict(bench_dsn)
+        yield {
+            "POSTGRES_URL": bench_dsn,
+            "DB_HOST": params.get("host", "localhost"),
+            "DB_PORT": str(params.get("port", "5432")),
+            "DB_NAME": db_name,
+            "DB_USER": params.get("user", ""),
+            "DB_PASSWORD": params.get("password", ""),
+        }
+    finally:
+        with psycopg.connect(admin_dsn, autocommit=True) as admin:
+            admin.execute(f'DROP DATABASE IF EXISTS "{db_name}" WITH (FORCE)')
+        logger.info(f"Dropped throwaway database {db_name}")
+
+
+def write_sample_pdf(path: str, pages: int, seed: int = 0):
+    """Write a text-only PDF with deterministic, searchable content"""
+    import random
+
+    import fitz
+
+    words = (
+        "retrieval embedding vector index chunk document query answer context "
+        "latency throughput cache pool worker planner rerank model token stream "
+        "postgres storage bucket upload pipeline batch memory process thread"
+    ).split()
+    rng = random.Random(seed)
+    pdf = fitz.open()
+    for page_num in range(pages):
+        page = pdf.new_page()
+        page.insert_text((72, 72), f"Section {page_num + 1}", fontsize=16)
+        paragraph = []
+        for line in range(40):
+            paragraph.append(" ".join(rng.choice(words) for _ in range(12)))
+        page.insert_textbox(fitz.Rect(72, 100, 540, 760), "\n".join(paragraph), fontsize=9)
+    pdf.save(path)
+    pdf.close()
@@ -0,0 +1,114 @@
+"""
+Cold-start budget check for the API process.
+
+Runs `python -X importtime -c "import app"` in --runs fresh interpreters,
+reports the slowest top-level imports of the median run and fails if the
+median total exceeds the budget or if any module that should be deferred
+(torch, chromadb, fitz, ...) is imported eagerly.
+
+A single import varies by about 10% between runs (`import app` measured
+690-1020 ms on one machine), so the gate compares the median against a
+budget well above that baseline.
+
+    python -m bench.startup --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only load on first use or during warm-up
+DEFERRED_MODULES = (
+    "torch",
+    "sentence_transformers",
+    "chromadb",
+    "fitz",
+    "pymupdf",
+    "boto3",
+    "groq",
+    "langfuse",
+    "langgraph",
+    "langchain_groq",
+    "langchain_postgres",
+)
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(module: str = "app"):
+    """Return [(cumulative_us, depth, name)] from -X importtime for one fresh import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        env={**os.environ, "PYTHONPATH": REPO_ROOT},
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+            entries.append((cumulative, (len(indent) - 1) // 2, name))
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to take the median of")
+    parser.add_argument("--top", type=int, default=15, help="Slowest top-level imports to list")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for _ in range(max(args.runs, 1)):
+        entries = measure_imports(args.module)
+        runs.append((next((c for c, _, name in entries if name == args.module), 0) / 1000, entries))
+    runs.sort(key=lambda run: run[0])
+    total_ms, entries = runs[len(runs) // 2]
+    top_level = sorted(
+        ((c / 1000, name) for c, depth, name in entries if depth == 1),
+        reverse=True,
+    )[: args.top]
+    eager = sorted({
+        name for _, run_entries in runs for _, _, name in run_entries
+        if name.split(".")[0] in DEFERRED_MODULES
+    })
+
+    report = {
+        "module": args.module,
+        "total_ms": total_ms,
+        "runs_ms": [round(run_ms, 1) for run_ms, _ in runs],
+        "budget_ms": args.budget_ms,
+        "slowest": [{"module": name, "ms": ms} for ms, name in top_level],
+        "eager_deferred_modules": eager,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import {args.module} took {total_ms:.0f} ms, median of {len(runs)} (budget {args.budget_ms:.0f} ms)")
+        failed = True
+    if eager:
+        print(f"FAIL: deferred modules imported eagerly: {', '.join(eager[:10])}")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
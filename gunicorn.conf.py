@@ -0,0 +1,36 @@
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py app:app
+#
+# Each worker runs the FastAPI lifespan on its own (DB pools, vector store,
+# embedding model). Use VECTOR_STORE=pgvector or a Chroma server (CHROMA_HOST)
+# when running more than one worker; the local Chroma store is single-process.
+import multiprocessing
+import os
+
+# Whether every worker can share the vector store (the local Chroma store cannot)
+SHARED_VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma").lower() == "pgvector" or bool(os.getenv("CHROMA_HOST"))
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() if SHARED_VECTOR_STORE else 1))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Chat responses stream for a while; don't kill workers mid-stream
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth from model/tensor caches
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+
+# Load the app in each worker, not the master: pools and models are per process
+preload_app = False
+
+
+def on_starting(server):
+    # Checked against the resolved worker count (-w / --workers included)
+    if server.cfg.workers > 1 and not SHARED_VECTOR_STORE:
+        raise RuntimeError(
+            f"{server.cfg.workers} workers cannot share the local Chroma store at "
+            f"{os.getenv('CHROMA_PATH', 'chroma_store')}; set VECTOR_STORE=pgvector or CHROMA_HOST, "
+            "or run a single worker"
+        )
@@ -1,5 +1,15 @@
 from ingestion_utils.ingestion import __upload_file_to_b2 as upload_file_to_b2
+from ingestion_utils.ingestion import __upload_fileobj_to_b2 as upload_fileobj_to_b2
+from ingestion_utils.ingestion import __aupload_file_to_b2 as aupload_file_to_b2
+from ingestion_utils.ingestion import __aupload_fileobj_to_b2 as aupload_fileobj_to_b2
+from ingestion_utils.ingestion import __get_b2_client as get_b2_client
 from ingestion_utils.ingestion import __get_b2_resource as get_b2_resource
 from ingestion_utils.ingestion import __download_file_from_b2 as download_file_from_b2
+from ingestion_utils.ingestion import __download_fileobj_from_b2 as download_fileobj_from_b2
+from ingestion_utils.ingestion import __adownload_file_from_b2 as adownload_file_from_b2
+from ingestion_utils.ingestion import __adownload_fileobj_from_b2 as adownload_fileobj_from_b2
+from ingestion_utils.ingestion import __adelete_objects_from_b2 as adelete_objects_from_b2
 from ingestion_utils.ingestion import __extract_text_and_images as extract_text_and_images
-from ingestion_utils.ingestion import __chunk_and_embed as chunk_and_embed
\ No newline at end of file
+from ingestion_utils.ingestion import __chunk_and_embed as chunk_and_embed
+from ingestion_utils.ingestion import __spool_upload as spool_upload
+from ingestion_utils.ingestion import __iter_text_and_images as iter_text_and_images
\ No newline at end of file
@@ -0,0 +1,442 @@
+"""
+Bulk ingestion of PDFs from a local directory or a B2 prefix.
+
+    python -m ingestion_utils.bulk ./archive --upload
+    python -m ingestion_utils.bulk b2://my-bucket/reports/2024/ --workers 8
+
+Whole documents are extracted in parallel on the extraction process pool
+and chunked in this process. Chunks from several documents are embedded
+together in large batches with one shared model, and each batch is stored
+through save_chunk_embeddings (one executemany and one vector store add
+per file in the batch).
+
+A document is appended to the manifest (JSON lines, keyed by the file's
+sha256) only once all of its chunks are stored. An interrupted run
+therefore resumes where it stopped, and files already processed are
+skipped even if they were renamed. B2 objects whose key, ETag and size
+are already listed are skipped before they are downloaded.
+"""
+import argparse
+import asyncio
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+from ingestion_utils import adownload_file_from_b2, aupload_file_to_b2, get_b2_client
+from ingestion_utils.extraction import extract_document, get_extraction_pool, page_documents, shutdown_extraction_pool
+from ingestion_utils.ingestion import UPLOAD_CHUNK_SIZE
+from utils.embeddings import encode_texts, get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+# Chunks per embedding batch; batches span documents
+BULK_EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE", "256"))
+
+# path is None for B2 objects; etag and size are only known for B2 objects
+Source = namedtuple("Source", ["key", "path", "etag", "size"], defaults=(None, None))
+Extracted = namedtuple("Extracted", ["source", "content_hash", "base_metadata", "pages"])
+Finished = namedtuple("Finished", ["extracted", "file_id", "chunks"])
+
+
+def is_infrastructure_error(error: BaseException) -> bool:
+    """Errors every following document would hit too (database down, out of memory or disk): abort the run"""
+    import psycopg
+
+    if isinstance(error, (psycopg.OperationalError, psycopg.InterfaceError, MemoryError)):
+        return True
+    return isinstance(error, OSError) and error.errno == errno.ENOSPC
+
+
+def sha256_file(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def parse_b2_url(source: str):
+    """(bucket, prefix) for b2://bucket/prefix, else None"""
+    if not source.startswith("b2://"):
+        return None
+    bucket, _, prefix = source[len("b2://"):].partition("/")
+    return bucket, prefix
+
+
+def iter_local(directory: str):
+    """PDFs under directory, keyed by their path relative to it"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                path = os.path.join(root, name)
+                yield Source(os.path.relpath(path, directory).replace(os.sep, "/"), path)
+
+
+def iter_b2(client, bucket: str, prefix: str):
+    """PDF object keys under prefix"""
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            if item["Key"].lower().endswith(".pdf"):
+                yield Source(item["Key"], None, item.get("ETag"), item.get("Size"))
+
+
+class Manifest:
+    """
+    Append-only JSON lines of ingested documents, keyed by content hash.
+
+    B2 entries also record the object's ETag and size, so an unchanged
+    object can be recognised from the bucket listing alone.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hashes = set()
+        self.objects = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self._index(json.loads(line))
+                    except (ValueError, KeyError):
+                        # A line cut short by an interrupted run
+                        continue
+        self._file = open(path, "a")
+
+    def _index(self, entry: dict):
+        self.hashes.add(entry["content_hash"])
+        if entry.get("etag"):
+            self.objects.add((entry["object_key"], entry["etag"], entry.get("size")))
+
+    def __contains__(self, content_hash: str) -> bool:
+        return content_hash in self.hashes
+
+    def has_object(self, source: Source) -> bool:
+        """Whether this exact B2 object (key, ETag, size) was ingested"""
+        return source.etag is not None and (source.key, source.etag, source.size) in self.objects
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, entry: dict):
+        self._index(entry)
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class BulkIngest:
+    """
+    Four concurrent stages joined by bounded queues:
+
+        prepare   download (B2), hash, skip if in the manifest, optional
+                  upload (local), extraction on the process pool
+        chunk     content row + TokenChunker, packed into cross-document batches
+        embed     one encode_texts call per batch
+        store     save_chunk_embeddings per file in the batch, then manifest
+    """
+
+    def __init__(self, database_manager, manifest: Manifest, workers: int, batch_size: int = BULK_EMBED_BATCH_SIZE,
+                 bucket: str = None, upload: bool = False, report_every: float = 30.0):
+        self.database_manager = database_manager
+        self.manifest = manifest
+        self.workers = workers
+        self.batch_size = batch_size
+        self.bucket = bucket
+        self.upload = upload
+        self.report_every = report_every
+        self.stats = {"documents": 0, "chunks": 0, "skipped": 0, "failed": 0}
+        self._queued = set()
+        self._failed_files = set()
+        self._keys = {}  # file id -> source key, for error messages
+        self._started = None
+        self._reported = None
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self._started
+        return {
+            **self.stats,
+            "seconds": elapsed,
+            "docs_per_second": self.stats["documents"] / elapsed if elapsed else 0.0,
+            "chunks_per_second": self.stats["chunks"] / elapsed if elapsed else 0.0,
+        }
+
+    def _maybe_report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._reported < self.report_every:
+            return
+        self._reported = now
+        s = self.summary()
+        logger.info(
+            f"{s['documents']} docs ({s['docs_per_second']:.2f}/s), {s['chunks']} chunks "
+            f"({s['chunks_per_second']:.1f}/s), {s['skipped']} skipped, {s['failed']} failed"
+        )
+
+    async def _prepare(self, source: Source):
+        """Hash and extract one document; None if it is skipped or fails"""
+        loop = asyncio.get_running_loop()
+        temp_path = None
+        try:
+            if self.manifest.has_object(source):
+                self.stats["skipped"] += 1
+                return None
+            path = source.path
+            if path is None:
+                fd, temp_path = tempfile.mkstemp(prefix="bulk_", suffix=".pdf")
+                os.close(fd)
+                if not await adownload_file_from_b2(get_b2_client(), self.bucket, source.key, temp_path):
+                    raise RuntimeError("download failed")
+                path = temp_path
+
+            content_hash = await asyncio.to_thread(sha256_file, path)
+            # Also skip copies of a document already queued in this run
+            if content_hash in self.manifest or content_hash in self._queued:
+                self.stats["skipped"] += 1
+                return None
+            self._queued.add(content_hash)
+
+            extraction = loop.run_in_executor(get_extraction_pool(self.workers), extract_document, path)
+            if self.upload and source.path is not None:
+                uploaded, (base_metadata, pages) = await asyncio.gather(
+                    aupload_file_to_b2(get_b2_client(), path, self.bucket, source.key), extraction
+                )
+                if not uploaded:
+                    raise RuntimeError("upload failed")
+            else:
+                base_metadata, pages = await extraction
+
+            # The key, not a temporary path, identifies the document
+            base_metadata.update(source=source.key, file_path=source.key)
+            return Extracted(source, content_hash, base_metadata, pages)
+        except Exception as e:
+            self._fail(source.key, e)
+            return None
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+
+    def _fail(self, key: str, error: Exception, file_id: str = None):
+        """Count one document as failed and go on, unless the error would stop every document"""
+        if is_infrastructure_error(error):
+            raise error
+        self.stats["failed"] += 1
+        if file_id is not None:
+            # Its remaining batches are dropped and it stays out of the manifest,
+            # so the next run replaces whatever chunks were stored
+            self._failed_files.add(file_id)
+        logger.error(f"Skipping {key}: {error}")
+
+    async def _register(self, extracted: Extracted) -> str:
+        """Content row for the document, dropping chunks left by an interrupted run or an older version"""
+        key = extracted.source.key
+        file_id = await self.database_manager.save_content_db(
+            file_name=f"internal_{key}", object_key=key, content_hash=extracted.content_hash
+        )
+        if file_id is None:
+            raise RuntimeError(f"Could not record {key} in the content table")
+        if await self.database_manager.count_chunks([file_id]):
+            await self.database_manager.delete_chunks([file_id])
+        return file_id
+
+    async def run(self, sources):
+        from ingestion_utils.chunking import TokenChunker
+
+        self._started = self._reported = time.perf_counter()
+        model = await asyncio.to_thread(get_embedding_model)
+        splitter = TokenChunker.from_model(model)
+
+        extracted_queue = asyncio.Queue(maxsize=self.workers)
+        batch_queue = asyncio.Queue(maxsize=2)
+        embedded_queue = asyncio.Queue(maxsize=2)
+        # Documents being downloaded or extracted at once
+        slots = asyncio.Semaphore(self.workers * 2)
+
+        async def prepare_stage():
+            async def prepare(source):
+                try:
+                    extracted = await self._prepare(source)
+                    if extracted is not None:
+                        await extracted_queue.put(extracted)
+                finally:
+                    slots.release()
+
+            tasks, errors = set(), []
+
+            def finished(task):
+                # Tasks leave the set when done, so keep their errors (those _fail re-raises) here
+                tasks.discard(task)
+                if not task.cancelled() and task.exception() is not None:
+                    errors.append(task.exception())
+
+            sources_iter = iter(sources)
+            try:
+                while not errors:
+                    # Listing a bucket blocks on the network
+                    source = await asyncio.to_thread(next, sources_iter, None)
+                    if source is None:
+                        break
+                    await slots.acquire()
+                    task = asyncio.create_task(prepare(source))
+                    tasks.add(task)
+                    task.add_done_callback(finished)
+                if tasks:
+                    await asyncio.gather(*tasks)
+            except BaseException:
+                for task in list(tasks):
+                    task.cancel()
+                raise
+            if errors:
+                raise errors[0]
+            await extracted_queue.put(None)
+
+        def split(extracted):
+            splitter.section = None
+            return splitter.split_documents(page_documents(extracted.base_metadata, extracted.pages))
+
+        async def chunk_stage():
+            # A document is finished with the batch holding its last chunk
+            batch, finished = [], []
+            while True:
+                extracted = await extracted_queue.get()
+                if extracted is None:
+                    break
+                try:
+                    file_id = await self._register(extracted)
+                    self._keys[file_id] = extracted.source.key
+                    chunks = await asyncio.to_thread(split, extracted)
+                except Exception as e:
+                    self._fail(extracted.source.key, e)
+                    continue
+                for chunk in chunks:
+                    batch.append((file_id, chunk))
+                    if len(batch) >= self.batch_size:
+                        await batch_queue.put((batch, finished))
+                        batch, finished = [], []
+                finished.append(Finished(extracted, file_id, len(chunks)))
+            await batch_queue.put((batch, finished))
+            await batch_queue.put(None)
+
+        async def embed_stage():
+            while True:
+                item = await batch_queue.get()
+                if item is None:
+                    await embedded_queue.put(None)
+                    return
+                batch, finished = item
+                embeddings = None
+                if batch:
+                    texts = [chunk.page_content for _, chunk in batch]
+                    embeddings = await asyncio.to_thread(encode_texts, texts, self.batch_size)
+                await embedded_queue.put((batch, embeddings, finished))
+
+        async def store_stage():
+            while True:
+                item = await embedded_queue.get()
+                if item is None:
+                    return
+                batch, embeddings, finished = item
+                by_file = {}
+                for index, (file_id, _) in enumerate(batch):
+                    by_file.setdefault(file_id, []).append(index)
+                for file_id, indices in by_file.items():
+                    if file_id in self._failed_files:
+                        continue
+                    try:
+                        await self.database_manager.save_chunk_embeddings(
+                            [batch[i][1] for i in indices], embeddings[indices], file_id=file_id
+                        )
+                    except Exception as e:
+                        self._fail(self._keys.get(file_id, file_id), e, file_id)
+                        continue
+                    self.stats["chunks"] += len(indices)
+                for done in finished:
+                    if done.file_id in self._failed_files:
+                        continue
+                    source = done.extracted.source
+                    self.manifest.add({
+                        "content_hash": done.extracted.content_hash,
+                        "object_key": source.key,
+                        "etag": source.etag,
+                        "size": source.size,
+                        "file_id": done.file_id,
+                        "chunks": done.chunks,
+                    })
+                    self.stats["documents"] += 1
+                self._maybe_report()
+
+        tasks = [asyncio.create_task(stage()) for stage in (prepare_stage, chunk_stage, embed_stage, store_stage)]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+        self._maybe_report(force=True)
+        return self.summary()
+
+
+async def run_bulk(args) -> dict:
+    from utils import DatabaseManager
+
+    b2 = parse_b2_url(args.source)
+    bucket = b2[0] if b2 else os.getenv("B2_BUCKET_NAME")
+    if args.upload and not bucket:
+        raise SystemExit("--upload needs B2_BUCKET_NAME")
+    if b2:
+        sources = iter_b2(get_b2_client(), *b2)
+    elif os.path.isdir(args.source):
+        sources = iter_local(args.source)
+    else:
+        raise SystemExit(f"{args.source} is neither a directory nor a b2://bucket/prefix URL")
+
+    db_manager = DatabaseManager()
+    if not db_manager.initialize_pool():
+        raise SystemExit("Database initialization failed")
+    await db_manager.open_pool()
+    manifest = Manifest(args.manifest)
+    logger.info(f"Manifest {args.manifest}: {len(manifest)} documents already ingested")
+    try:
+        if not await db_manager.create_content_table():
+            raise SystemExit("Table creation failed")
+        await db_manager.initialize_vector_store()
+        ingest = BulkIngest(
+            db_manager, manifest, workers=args.workers, batch_size=args.batch_size,
+            bucket=bucket, upload=args.upload, report_every=args.report_every,
+        )
+        return await ingest.run(sources)
+    finally:
+        manifest.close()
+        await db_manager.close_pool()
+        shutdown_extraction_pool()
+
+
+def main(argv=None):
+    from ingestion_utils.extraction import MAX_WORKERS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Local directory or b2://bucket/prefix")
+    parser.add_argument("--manifest", default="ingest_manifest.jsonl", help="Processed content hashes (JSON lines)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Extraction processes")
+    parser.add_argument("--batch-size", type=int, default=BULK_EMBED_BATCH_SIZE, help="Chunks per embedding batch")
+    parser.add_argument("--upload", action="store_true", help="Also upload local files to B2_BUCKET_NAME")
+    parser.add_argument("--report-every", type=float, default=30.0, help="Seconds between progress lines")
+    parser.add_argument("--report", help="Write the final figures as JSON to this path")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = asyncio.run(run_bulk(args))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import re
+
+from langchain_core.documents import Document
+
+# Tokens reserved for [CLS]/[SEP] when deriving the limit from max_seq_length
+SPECIAL_TOKENS = 2
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+_PARAGRAPH_RE = re.compile(r"\S(?:.*?\S)?(?=\n\s*\n|\s*$)", re.S)
+
+
+class TokenChunker:
+    """
+    Structure-aware chunker that measures length in embedding-model tokens.
+
+    Pages from iter_pdf carry a "blocks" list of (start, end, is_heading)
+    character spans. Whole blocks are packed into chunks of at most
+    max_tokens, a heading always starts a new chunk, and blocks longer than
+    the limit are cut into token windows with overlap_tokens of overlap.
+    Documents without blocks are split on blank lines.
+
+    Each chunk's metadata gains start_offset/end_offset (characters within
+    the page), token_count and section (the most recent heading).
+    """
+
+    def __init__(self, tokenizer, max_tokens: int, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.section = None
+
+    @classmethod
+    def from_model(cls, model, max_tokens: int = None, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        """Build a chunker sized to a SentenceTransformer's max_seq_length"""
+        limit = model.max_seq_length - SPECIAL_TOKENS
+        max_tokens = max_tokens or CHUNK_MAX_TOKENS or limit
+        return cls(model.tokenizer, min(max_tokens, limit), overlap_tokens)
+
+    def _blocks(self, doc: Document):
+        blocks = doc.metadata.get("blocks")
+        if blocks:
+            return blocks
+        return [(m.start(), m.end(), False) for m in _PARAGRAPH_RE.finditer(doc.page_content)]
+
+    def split_documents(self, documents):
+        chunks = []
+        for doc in documents:
+            chunks.extend(self._split(doc))
+        return chunks
+
+    def _split(self, doc: Document):
+        text = doc.page_content
+        blocks = self._blocks(doc)
+        if not blocks:
+            return []
+
+        encoded = self.tokenizer(
+            [text[start:end] for start, end, _ in blocks],
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+        )
+        base_metadata = {k: v for k, v in doc.metadata.items() if k != "blocks"}
+        chunks = []
+        current = []  # (start, end, token_count) of blocks in the open chunk
+        current_tokens = 0
+
+        def emit(start, end, token_count):
+            chunks.append(Document(
+                page_content=text[start:end],
+                metadata={
+                    **base_metadata,
+                    "start_offset": start,
+                    "end_offset": end,
+                    "token_count": token_count,
+                    "section": self.section,
+                },
+            ))
+
+        def flush():
+            nonlocal current, current_tokens
+            if current:
+                emit(current[0][0], current[-1][1], current_tokens)
+            current, current_tokens = [], 0
+
+        for (start, end, is_heading), offsets in zip(blocks, encoded["offset_mapping"]):
+            n_tokens = len(offsets)
+            if is_heading:
+                flush()
+                self.section = text[start:end].strip()
+
+            if n_tokens > self.max_tokens:
+                # A short lead-in (typically a heading) joins the first window
+                if current and current_tokens <= self.max_tokens // 4:
+                    lead_start, lead_tokens = current[0][0], current_tokens
+                    current, current_tokens = [], 0
+                else:
+                    flush()
+                    lead_start, lead_tokens = None, 0
+                i = 0
+                while True:
+                    budget = self.max_tokens - lead_tokens
+                    window = offsets[i:i + budget]
+                    chunk_start = lead_start if lead_start is not None else start + window[0][0]
+                    emit(chunk_start, start + window[-1][1], len(window) + lead_tokens)
+                    if i + budget >= n_tokens:
+                        break
+                    i += max(1, budget - self.overlap_tokens)
+                    lead_start, lead_tokens = None, 0
+                continue
+
+            if current_tokens + n_tokens > self.max_tokens:
+                flush()
+            current.append((start, end, n_tokens))
+            current_tokens += n_tokens
+
+        flush()
+        return chunks
@@ -0,0 +1,184 @@
+import logging
+import math
+import multiprocessing
+import os
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+ExtractedImage = namedtuple("ExtractedImage", ["xref", "page", "index", "ext", "data"])
+
+# PDFs shorter than this are extracted in-process; the pool isn't worth the IPC
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+MAX_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+
+_executor = None
+
+
+def get_extraction_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    """Process pool shared by all extractions (spawned once, on first use)"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers or MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_extraction_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def _page_text_and_blocks(page):
+    """
+    Rebuild page text from PyMuPDF text blocks.
+
+    Returns the text (blocks joined by blank lines) and a list of
+    (start, end, is_heading) character spans, one per block. A short block
+    set in a larger font than the page's body text (or bold at body size)
+    is treated as a heading.
+    """
+    import fitz
+
+    raw_blocks = []
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        if block.get("type") != 0:
+            continue
+        lines, size, bold = [], 0.0, True
+        for line in block["lines"]:
+            lines.append("".join(span["text"] for span in line["spans"]))
+            for span in line["spans"]:
+                if span["text"].strip():
+                    size = max(size, span["size"])
+                    bold = bold and bool(span["flags"] & fitz.TEXT_FONT_BOLD)
+        block_text = "\n".join(lines).strip()
+        if block_text:
+            raw_blocks.append((block_text, size, bold, len(block["lines"])))
+
+    weights = Counter()
+    for block_text, size, _, _ in raw_blocks:
+        weights[round(size, 1)] += len(block_text)
+    body_size = weights.most_common(1)[0][0] if weights else 0.0
+
+    parts, blocks, offset = [], [], 0
+    for block_text, size, bold, n_lines in raw_blocks:
+        is_heading = (
+            len(block_text) <= 120
+            and n_lines <= 2
+            and (size >= body_size * 1.15 or (bold and size >= body_size))
+        )
+        if parts:
+            offset += 2
+        blocks.append((offset, offset + len(block_text), is_heading))
+        parts.append(block_text)
+        offset += len(block_text)
+    return "\n\n".join(parts), blocks
+
+
+def _extract_page_range(file_path, start, stop, extract_images):
+    """
+    Worker: open the PDF by path and extract pages [start, stop).
+
+    Returns (pages as (page_num, text, blocks), image references); image bytes are pulled once
+    per xref by the parent so shared images don't cross the pipe twice.
+    """
+    import fitz
+
+    pages, image_refs = [], []
+    with fitz.open(file_path) as pdf:
+        for page_num in range(start, stop):
+            page = pdf.load_page(page_num)
+            text, blocks = _page_text_and_blocks(page)
+            pages.append((page_num, text, blocks))
+            if extract_images:
+                for img_index, img in enumerate(page.get_images(full=True)):
+                    image_refs.append((img[0], page_num, img_index))
+    return pages, image_refs
+
+
+def _page_ranges(total_pages, workers):
+    size = max(8, math.ceil(total_pages / (workers * 4)))
+    return [(start, min(start + size, total_pages)) for start in range(0, total_pages, size)]
+
+
+def _base_metadata(pdf, file_path):
+    return {
+        **{k: v for k, v in (pdf.metadata or {}).items() if v},
+        "source": file_path,
+        "file_path": file_path,
+        "total_pages": len(pdf),
+    }
+
+
+def extract_document(file_path):
+    """
+    Worker: extract a whole PDF's text in the calling process.
+
+    Used by bulk ingestion, which spreads whole documents over the pool
+    instead of splitting one document into page ranges. Returns
+    (base metadata, pages as (page_num, text, blocks)).
+    """
+    import fitz
+
+    with fitz.open(file_path) as pdf:
+        base_metadata = _base_metadata(pdf, file_path)
+    pages, _ = _extract_page_range(file_path, 0, base_metadata["total_pages"], False)
+    return base_metadata, pages
+
+
+def page_documents(base_metadata, pages):
+    """Page Documents for extracted (page_num, text, blocks) tuples"""
+    from langchain_core.documents import Document
+
+    for page_num, text, blocks in pages:
+        yield Document(
+            page_content=text,
+            metadata={**base_metadata, "page": page_num, "blocks": blocks},
+        )
+
+
+def iter_pdf(file_path, extract_images=True):
+    """
+    Stream a PDF as page Documents and ExtractedImages, in page order.
+
+    The document is opened once here (page count, metadata, image bytes);
+    page text is extracted by the process pool in page ranges, each worker
+    opening the file by path. Images are deduplicated by xref.
+    """
+    import fitz
+
+    with fitz.open(file_path) as pdf:
+        base_metadata = _base_metadata(pdf, file_path)
+        total_pages = base_metadata["total_pages"]
+
+        if total_pages < PARALLEL_MIN_PAGES or MAX_WORKERS == 1:
+            results = [_extract_page_range(file_path, 0, total_pages, extract_images)]
+        else:
+            ranges = _page_ranges(total_pages, MAX_WORKERS)
+            results = get_extraction_pool().map(
+                _extract_page_range,
+                [file_path] * len(ranges),
+                [start for start, _ in ranges],
+                [stop for _, stop in ranges],
+                [extract_images] * len(ranges),
+            )
+
+        seen_xrefs = set()
+        for pages, image_refs in results:
+            yield from page_documents(base_metadata, pages)
+
+            for xref, page_num, img_index in image_refs:
+                if xref in seen_xrefs:
+                    continue
+                seen_xrefs.add(xref)
+                try:
+                    base_image = pdf.extract_image(xref)
+                except Exception as e:
+                    logger.warning(f"Could not extract image xref={xref}: {e}")
+                    continue
+                yield ExtractedImage(xref, page_num, img_index, base_image["ext"], base_image["image"])
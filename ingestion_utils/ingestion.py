@@ -1,17 +1,18 @@
+# Heavy dependencies (boto3, groq, fitz, langchain, sentence-transformers)
+# are imported inside the functions that need them to keep API start-up fast.
+import asyncio
 import base64
 import logging
-import boto3, os
+import os
 from dotenv import load_dotenv
-import fitz
-from groq import Groq
-from langchain.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import uuid
-import os
 import tempfile
-from langchain_core.documents import Document
+import shutil
 import hashlib
-from sentence_transformers import SentenceTransformer
+
+from ingestion_utils.extraction import ExtractedImage, iter_pdf
+from utils.embeddings import encode_texts, get_embedding_model
+from utils.metrics import STORAGE_TRANSFER_LATENCY
 
 load_dotenv(".env")
 
@@ -19,18 +20,85 @@ b2_endpoint = os.getenv("B2_ENDPOINT_URL")
 b2_access_key = os.getenv("AWS_ACCESS_KEY_ID")
 b2_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Transfer tuning: objects above the threshold go up/down as parallel parts
+B2_MULTIPART_THRESHOLD = int(float(os.getenv("B2_MULTIPART_THRESHOLD_MB", "16")) * 1024 * 1024)
+B2_MULTIPART_CHUNKSIZE = int(float(os.getenv("B2_MULTIPART_CHUNKSIZE_MB", "16")) * 1024 * 1024)
+B2_MAX_CONCURRENCY = int(os.getenv("B2_MAX_CONCURRENCY", "8"))
+# Shared by every transfer in the process, so above B2_MAX_CONCURRENCY
+B2_MAX_POOL_CONNECTIONS = int(os.getenv("B2_MAX_POOL_CONNECTIONS", "32"))
+
+_b2_client = None
+_b2_resource = None
+_transfer_config = None
+
+
+def __get_b2_client():
+    """
+    Process-wide S3 client for B2 with a pooled connection set.
+
+    boto3 clients are thread-safe, so one client serves every request and
+    transfer thread; building one per request costs far more than the
+    transfer of a small document.
+    """
+    global _b2_client
+    if _b2_client is None:
+        import boto3
+        from botocore.config import Config
+
+        _b2_client = boto3.client(
+            service_name='s3',
+            endpoint_url=b2_endpoint,
+            aws_access_key_id=b2_access_key,
+            aws_secret_access_key=b2_secret_key,
+            config=Config(
+                max_pool_connections=B2_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+                tcp_keepalive=True,
+            ),
+        )
+    return _b2_client
+
+
 def __get_b2_resource():
-    b2_resource = boto3.resource(service_name='s3',
+    """Cached boto3 resource; kept for callers that need the resource API"""
+    global _b2_resource
+    if _b2_resource is None:
+        import boto3
+
+        _b2_resource = boto3.resource(service_name='s3',
                         endpoint_url=b2_endpoint,     
                         aws_access_key_id=b2_access_key,
                         aws_secret_access_key=b2_secret_key)
-    return b2_resource
+    return _b2_resource
+
+
+def _transfer():
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _transfer_config = TransferConfig(
+            multipart_threshold=B2_MULTIPART_THRESHOLD,
+            multipart_chunksize=B2_MULTIPART_CHUNKSIZE,
+            max_concurrency=B2_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+    return _transfer_config
+
 
-def __upload_file_to_b2(b2_resource, local_file_path, bucket_name, object_name=None):
+def _client(b2):
+    # Accept the client or a resource (whose client carries the same connection pool)
+    meta = getattr(b2, "meta", None)
+    return meta.client if meta is not None and hasattr(meta, "client") else b2
+
+
+def __upload_file_to_b2(b2_client, local_file_path, bucket_name, object_name=None):
     """
-    Upload a file to a B2 bucket
+    Upload a file to a B2 bucket (multipart above B2_MULTIPART_THRESHOLD_MB)
     
-    :param b2_resource: Boto3 resource for B2
+    :param b2_client: Boto3 S3 client (or resource) for B2
     :param local_file_path: Path to local file to upload
     :param bucket_name: Bucket to upload to
     :param object_name: S3 object name (if None, uses basename of local_file_path)
@@ -41,35 +109,121 @@ def __upload_file_to_b2(b2_resource, local_file_path, bucket_name, object_name=N
         object_name = os.path.basename(local_file_path)
         
     try:
-        # Get the bucket and upload the file
-        bucket = b2_resource.Bucket(bucket_name)
-        bucket.upload_file(local_file_path, object_name)
+        with STORAGE_TRANSFER_LATENCY.time(op="upload"):
+            _client(b2_client).upload_file(local_file_path, bucket_name, object_name, Config=_transfer())
         logging.info(f"Successfully uploaded {local_file_path} to {bucket_name}/{object_name}")
         return True
     except Exception as e:
         logging.error(f"Error uploading file: {e}")
         return False
 
-def __download_file_from_b2(b2_resource, bucket_name, object_name, local_file_path):
+def __upload_fileobj_to_b2(b2_client, fileobj, bucket_name, object_name):
+    """
+    Upload from a binary file-like object (BytesIO, a spooled or streamed
+    buffer) without writing it to disk first
+    
+    :return: True if the object was uploaded, else False
+    """
+    try:
+        with STORAGE_TRANSFER_LATENCY.time(op="upload"):
+            _client(b2_client).upload_fileobj(fileobj, bucket_name, object_name, Config=_transfer())
+        logging.info(f"Successfully uploaded buffer to {bucket_name}/{object_name}")
+        return True
+    except Exception as e:
+        logging.error(f"Error uploading buffer: {e}")
+        return False
+
+def __download_file_from_b2(b2_client, bucket_name, object_name, local_file_path):
     """
-    Download a file from a B2 bucket
+    Download a file from a B2 bucket (ranged parts in parallel for large objects)
     
-    :param b2_resource: Boto3 resource for B2
+    :param b2_client: Boto3 S3 client (or resource) for B2
     :param bucket_name: Bucket to download from
     :param object_name: S3 object name to download
     :param local_file_path: Path where to save the downloaded file
     :return: True if file was downloaded, else False
     """
     try:
-        # Get the bucket and download the file
-        bucket = b2_resource.Bucket(bucket_name)
-        bucket.download_file(object_name, local_file_path)
+        with STORAGE_TRANSFER_LATENCY.time(op="download"):
+            _client(b2_client).download_file(bucket_name, object_name, local_file_path, Config=_transfer())
         logging.info(f"Successfully downloaded {bucket_name}/{object_name} to {local_file_path}")
         return True
     except Exception as e:
         logging.error(f"Error downloading file: {e}")
         return False
+
+def __download_fileobj_from_b2(b2_client, bucket_name, object_name, fileobj):
+    """Download into a writable binary file-like object; True on success"""
+    try:
+        with STORAGE_TRANSFER_LATENCY.time(op="download"):
+            _client(b2_client).download_fileobj(bucket_name, object_name, fileobj, Config=_transfer())
+        return True
+    except Exception as e:
+        logging.error(f"Error downloading {bucket_name}/{object_name}: {e}")
+        return False
+
+def __delete_objects_from_b2(b2_client, bucket_name, object_names):
+    """
+    Delete objects in batches of 1000 (the DeleteObjects limit)
+
+    :return: Number of objects deleted
+    """
+    client = _client(b2_client)
+    deleted = 0
+    for start in range(0, len(object_names), 1000):
+        batch = object_names[start:start + 1000]
+        response = client.delete_objects(
+            Bucket=bucket_name,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        for error in response.get("Errors", []):
+            logging.error(f"Error deleting {bucket_name}/{error.get('Key')}: {error.get('Message')}")
+        deleted += len(batch) - len(response.get("Errors", []))
+    return deleted
+
+# Async wrappers: transfers run on a worker thread (boto3 is blocking)
+
+async def __aupload_file_to_b2(b2_client, local_file_path, bucket_name, object_name=None):
+    return await asyncio.to_thread(__upload_file_to_b2, b2_client, local_file_path, bucket_name, object_name)
+
+async def __aupload_fileobj_to_b2(b2_client, fileobj, bucket_name, object_name):
+    return await asyncio.to_thread(__upload_fileobj_to_b2, b2_client, fileobj, bucket_name, object_name)
+
+async def __adownload_file_from_b2(b2_client, bucket_name, object_name, local_file_path):
+    return await asyncio.to_thread(__download_file_from_b2, b2_client, bucket_name, object_name, local_file_path)
+
+async def __adownload_fileobj_from_b2(b2_client, bucket_name, object_name, fileobj):
+    return await asyncio.to_thread(__download_fileobj_from_b2, b2_client, bucket_name, object_name, fileobj)
+
+async def __adelete_objects_from_b2(b2_client, bucket_name, object_names):
+    return await asyncio.to_thread(__delete_objects_from_b2, b2_client, bucket_name, object_names)
+    
+async def __spool_upload(upload_file, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Stream an UploadFile to a temporary file without holding it in memory
     
+    :param upload_file: FastAPI UploadFile
+    :param chunk_size: Bytes read per chunk
+    :return: (temp file path, sha256 hex digest, size in bytes); the caller removes the file
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    suffix = os.path.splitext(upload_file.filename or "")[1]
+    fd, temp_path = tempfile.mkstemp(prefix="upload_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload_file.read(chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path, hasher.hexdigest(), size
+
 def encode_image(image_path):
     with open(image_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode('utf-8')
@@ -79,6 +233,8 @@ def describe_image_with_llm(image_path):
     Describe the image using Groq Vision API (LLaMA-4 Scout).
     """
     try:
+        from groq import Groq
+
         groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
         base64_image = encode_image(image_path)
         response = groq_client.chat.completions.create(
@@ -103,80 +259,140 @@ def describe_image_with_llm(image_path):
         logging.error(f"Image description failed: {e}")
         return f"Failed to describe image: {e}"
     
-def __extract_text_and_images(downloaded_file_path, extract_images):
-    print("here")
-    documents = []
-    # Step 1: Extract text content
-    loader = PyMuPDFLoader(downloaded_file_path)
-    doc_load = loader.load()
-    documents.extend(doc_load)
-    # doc_content = [doc.page_content for doc in doc_load]
-
-    # Step 2: Extract and save images using fitz
-    if extract_images:
-        image_descriptions = []
-        temp_image_dir = tempfile.mkdtemp(prefix="pdf_imgs_")
-        
-        pdf = fitz.open(downloaded_file_path)
-
-        for page_num in range(len(pdf)):
-            page = pdf.load_page(page_num)
-            images = page.get_images(full=True)
-
-            for img_index, img in enumerate(images):
-                xref = img[0]
-                base_image = pdf.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]
+def __iter_text_and_images(downloaded_file_path, extract_images):
+    """
+    Stream page Documents, followed per page range by Documents holding
+    LLM descriptions of the images on those pages.
+    """
+    from langchain_core.documents import Document
 
-                image_filename = f"page{page_num+1}_img{img_index+1}.{image_ext}"
+    temp_image_dir = tempfile.mkdtemp(prefix="pdf_imgs_") if extract_images else None
 
-                image_path = os.path.join(temp_image_dir, image_filename)
+    try:
+        for item in iter_pdf(downloaded_file_path, extract_images=extract_images):
+            if not isinstance(item, ExtractedImage):
+                yield item
+                continue
 
-                with open(image_path, "wb") as f:
-                    f.write(image_bytes)
+            image_filename = f"page{item.page+1}_img{item.index+1}.{item.ext}"
+            image_path = os.path.join(temp_image_dir, image_filename)
+            with open(image_path, "wb") as f:
+                f.write(item.data)
 
-                # Step 3: Generate description using LLM
+            # Generate description using LLM; the image is not needed afterwards
+            try:
                 description = describe_image_with_llm(image_path)
+            finally:
+                os.remove(image_path)
 
-                image_descriptions.append({
+            yield Document(
+                page_content=description,
+                metadata={
+                    "type": "image_description",
+                    "image_filename": image_filename,
                     "image_path": image_path,
-                    "description": description
-                })
-
-                documents.append(
-                    Document(
-                        page_content=description,
-                        metadata={
-                            "type": "image_description",
-                            "image_filename": image_filename,
-                            "page": page_num + 1,
-                            "source": downloaded_file_path
-                        }
-                    )
-                )
+                    "page": item.page + 1,
+                    "source": downloaded_file_path
+                }
+            )
+    finally:
+        # Also runs when the consumer stops early and the generator is closed
+        if temp_image_dir:
+            shutil.rmtree(temp_image_dir, ignore_errors=True)
+
+
+def __extract_text_and_images(downloaded_file_path, extract_images):
+    documents = []
+    image_descriptions = []
+    for doc in __iter_text_and_images(downloaded_file_path, extract_images):
+        documents.append(doc)
+        if doc.metadata.get("type") == "image_description":
+            image_descriptions.append({
+                "image_path": doc.metadata["image_path"],
+                "description": doc.page_content
+            })
 
     return {
         "text": documents,
-        "images": image_descriptions if extract_images else []
+        "images": image_descriptions
     }
 
 
-def __chunk_and_embed(documents, file_id, database_manager):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = splitter.split_documents(documents)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
 
-    # custom_id = hashlib.md5(file_path.encode()).hexdigest()
 
-    texts = [doc.page_content for doc in chunks]
-    print("texts")
+def _iter_chunk_batches(documents, splitter, batch_size):
+    """Split documents one at a time and group the chunks into batches"""
+    batch = []
+    for doc in documents:
+        for chunk in splitter.split_documents([doc]):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    texts = [doc.page_content for doc in chunks]
-    
-    # Generate embeddings locally
-    embeddings = model.encode(texts, convert_to_tensor=False)
-    embeddings = [emb.tolist() for emb in embeddings]
-    print("embeddings done")
-    database_manager.save_chunk_embeddings(chunks, embeddings, file_id=file_id)
-    
\ No newline at end of file
+
+async def __chunk_and_embed(documents, file_id, database_manager,
+                            batch_size=EMBED_BATCH_SIZE, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Chunk (by embedding-model tokens, see TokenChunker), embed and store
+    documents as a streaming pipeline.
+
+    documents may be any iterable (e.g. the generator from iter_text_and_images).
+    Splitting, embedding and storing run as three stages joined by bounded
+    queues, so extraction, encoding and writes overlap and at most
+    ~queue_size batches are held in memory at a time.
+
+    :return: Number of chunks stored
+    """
+    from ingestion_utils.chunking import TokenChunker
+
+    model = await asyncio.to_thread(get_embedding_model)
+    splitter = TokenChunker.from_model(model)
+    batches = _iter_chunk_batches(documents, splitter, batch_size)
+
+    chunk_queue = asyncio.Queue(maxsize=queue_size)
+    embed_queue = asyncio.Queue(maxsize=queue_size)
+    stored = 0
+
+    async def split_stage():
+        # The document iterator may block on extraction, so pull it off-loop
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            await chunk_queue.put(batch)
+            if batch is None:
+                return
+
+    async def embed_stage():
+        while True:
+            batch = await chunk_queue.get()
+            if batch is None:
+                await embed_queue.put(None)
+                return
+            texts = [doc.page_content for doc in batch]
+            embeddings = await asyncio.to_thread(encode_texts, texts, batch_size)
+            await embed_queue.put((batch, embeddings))
+
+    async def store_stage():
+        nonlocal stored
+        while True:
+            item = await embed_queue.get()
+            if item is None:
+                return
+            batch, embeddings = item
+            await database_manager.save_chunk_embeddings(batch, embeddings, file_id=file_id)
+            stored += len(batch)
+
+    tasks = [asyncio.create_task(stage()) for stage in (split_stage, embed_stage, store_stage)]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    logging.info(f"File {file_id}: {stored} chunks embedded and stored")
+    return stored
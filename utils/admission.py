@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+from utils.metrics import ADMISSION, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Idle per-client buckets kept before the oldest are dropped
+MAX_TRACKED_CLIENTS = 10000
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take one token; return 0 on success, else seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class AdmissionRejected(HTTPException):
+    """429 with Retry-After"""
+
+    def __init__(self, retry_after: float, detail: str):
+        super().__init__(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class AdmissionController:
+    """
+    Admission for one kind of work (chat, ingest).
+
+    Each client (JWT sub) has a token bucket of rate_per_minute requests
+    with a burst allowance. Admitted work then needs one of max_concurrency
+    slots; up to max_queue requests wait for a slot for at most
+    queue_timeout seconds, beyond that requests are rejected with 429 and a
+    Retry-After estimated from recent service times.
+
+    pressure() (0..1+) reports how loaded the controller is so callers can
+    shed optional work before requests start failing.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float,
+                 rate_per_minute: float, burst: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._avg_service = 1.0
+        self._publish()
+
+    @classmethod
+    def from_env(cls, name: str, max_concurrency: int, max_queue: int, queue_timeout: float,
+                 rate_per_minute: float, burst: int):
+        """Read <NAME>_MAX_CONCURRENCY, _MAX_QUEUE, _QUEUE_TIMEOUT, _RATE_PER_MINUTE and _BURST"""
+        prefix = name.upper()
+        return cls(
+            name,
+            max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", max_concurrency)),
+            max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", max_queue)),
+            queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", queue_timeout)),
+            rate_per_minute=float(os.getenv(f"{prefix}_RATE_PER_MINUTE", rate_per_minute)),
+            burst=int(os.getenv(f"{prefix}_BURST", burst)),
+        )
+
+    def _publish(self):
+        ADMISSION.set(self.in_flight, controller=self.name, stat="in_flight")
+        ADMISSION.set(self.waiting, controller=self.name, stat="waiting")
+        ADMISSION.set(self.pressure(), controller=self.name, stat="pressure")
+
+    def _reject(self, reason: str, retry_after: float, detail: str):
+        ADMISSION_REJECTED.inc(controller=self.name, reason=reason)
+        raise AdmissionRejected(retry_after, detail)
+
+    def pressure(self) -> float:
+        """in-flight share of the slots, plus the queue's share of its capacity"""
+        load = self.in_flight / self.max_concurrency
+        if self.max_queue:
+            load += self.waiting / self.max_queue
+        return load
+
+    def check_rate(self, client: str):
+        """Charge one request to client's bucket or raise 429"""
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > MAX_TRACKED_CLIENTS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(client)
+        wait = bucket.take()
+        if wait:
+            self._reject("rate_limited", wait, f"Rate limit exceeded for {self.name} requests")
+
+    async def acquire(self):
+        """Wait for a concurrency slot (bounded queue and wait) or raise 429"""
+        if self._slots.locked():
+            retry_after = self._avg_service * (self.waiting + 1) / self.max_concurrency
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full", retry_after, f"Too many {self.name} requests in progress")
+            self.waiting += 1
+            self._publish()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("queue_timeout", retry_after, f"Timed out waiting for a {self.name} slot")
+            finally:
+                self.waiting -= 1
+                self._publish()
+        else:
+            await self._slots.acquire()
+        self.in_flight += 1
+        self._publish()
+        return time.monotonic()
+
+    def release(self, started: float = None):
+        """Free a slot taken by acquire (pass acquire's return value to track service time)"""
+        self._slots.release()
+        self.in_flight -= 1
+        if started is not None:
+            self._avg_service = 0.9 * self._avg_service + 0.1 * (time.monotonic() - started)
+        self._publish()
@@ -0,0 +1,244 @@
+import asyncio
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import psycopg
+
+from utils.embedding_cache import EMBEDDINGS_CHANNEL, get_embedding_cache
+from utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = "content_changed"
+
+# Fired once per changed content row; chunk_count updates during ingestion are excluded
+CATALOG_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION notify_content_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        '{CATALOG_CHANNEL}',
+        json_build_object('op', TG_OP, 'id', COALESCE(NEW.id, OLD.id))::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'content_changed' AND tgrelid = 'content'::regclass
+    ) THEN
+        CREATE TRIGGER content_changed
+            AFTER INSERT OR DELETE OR UPDATE OF file_name, object_key, downloaded_on ON content
+            FOR EACH ROW EXECUTE FUNCTION notify_content_changed();
+    END IF;
+END;
+$$;
+"""
+
+_FILE_COLUMNS = "id, file_name, object_key, downloaded_on"
+
+
+def _row_to_file(row) -> dict:
+    return {"id": str(row[0]), "file_name": row[1], "object_key": row[2], "downloaded_on": row[3]}
+
+
+def _public(file: dict) -> dict:
+    return {**file, "downloaded_on": file["downloaded_on"].isoformat() if file["downloaded_on"] else None}
+
+
+def encode_cursor(file: dict) -> str:
+    """Opaque keyset cursor for the position after file in (downloaded_on, id) DESC order"""
+    stamp = file["downloaded_on"].isoformat() if file["downloaded_on"] else ""
+    return base64.urlsafe_b64encode(f"{stamp}|{file['id']}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    try:
+        stamp, file_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return (datetime.fromisoformat(stamp) if stamp else None), file_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _sort_key(file: dict):
+    # Newest first, id as tie-breaker; rows without a timestamp sort last,
+    # still ordered by id so a cursor can land between them
+    stamp = file["downloaded_on"]
+    return (0, datetime.min, file["id"]) if stamp is None else (1, stamp, file["id"])
+
+
+class FileCatalog:
+    """
+    In-process copy of the content table (id, file_name, object_key,
+    downloaded_on) for name lookups and the documents list.
+
+    A trigger on content publishes every change on the content_changed
+    channel; each worker LISTENs on a dedicated connection and applies the
+    changed rows, so workers see each other's uploads and deletes. While
+    the listener is down the catalog reports itself not ready and callers
+    go to the database; after reconnecting it reloads everything.
+
+    The same connection LISTENs on the embeddings_changed channel and
+    drops the embedding cache entries of files whose chunks changed.
+    """
+
+    def __init__(self, database_manager, reconnect_delay: float = 1.0):
+        self.database_manager = database_manager
+        self.reconnect_delay = reconnect_delay
+        self.ready = False
+        self._files: Dict[str, dict] = {}
+        self._by_name: Dict[str, dict] = {}
+        self._ordered: Optional[List[dict]] = None
+        self._listener = None
+
+    async def install_trigger(self):
+        async with self.database_manager.get_connection("ingest") as conn:
+            await conn.execute(CATALOG_TRIGGER_SQL)
+            await conn.commit()
+
+    async def start(self):
+        """Install the trigger, then start listening and load the table"""
+        try:
+            await self.install_trigger()
+        except Exception as e:
+            # Usually another worker installing it at the same moment
+            logger.warning(f"Could not install the content_changed trigger: {e}")
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self.ready = False
+
+    async def _listen(self):
+        connected = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    self.database_manager._conninfo(), autocommit=True
+                ) as conn:
+                    # LISTEN before loading so no change between the two is lost
+                    await conn.execute(f"LISTEN {CATALOG_CHANNEL}")
+                    await conn.execute(f"LISTEN {EMBEDDINGS_CHANNEL}")
+                    if connected:
+                        # Chunk changes published while disconnected were missed
+                        get_embedding_cache().invalidate_all()
+                    connected = True
+                    await self.reload()
+                    self.ready = True
+                    logger.info(f"File catalog loaded: {len(self._files)} files")
+                    async for notify in conn.notifies():
+                        if notify.channel == EMBEDDINGS_CHANNEL:
+                            get_embedding_cache().invalidate(notify.payload)
+                        else:
+                            await self._apply(json.loads(notify.payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.ready = False
+                logger.warning(f"File catalog listener disconnected, retrying: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def reload(self):
+        async with self.database_manager.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT {_FILE_COLUMNS} FROM content;")
+                rows = await cur.fetchall()
+        self._files = {}
+        self._by_name = {}
+        for row in rows:
+            self._put(_row_to_file(row))
+        self._ordered = None
+
+    async def _apply(self, change: dict):
+        file_id = change["id"]
+        if change["op"] == "DELETE":
+            self._remove(file_id)
+            return
+        async with self.database_manager.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT {_FILE_COLUMNS} FROM content WHERE id = %s;", (file_id,))
+                row = await cur.fetchone()
+        self._remove(file_id)
+        if row:
+            self._put(_row_to_file(row))
+
+    def _put(self, file: dict):
+        self._files[file["id"]] = file
+        current = self._by_name.get(file["file_name"])
+        # Names are not unique; the most recent upload wins
+        if current is None or _sort_key(file) > _sort_key(current):
+            self._by_name[file["file_name"]] = file
+        self._ordered = None
+
+    def _remove(self, file_id: str):
+        file = self._files.pop(file_id, None)
+        if file is None:
+            return
+        if self._by_name.get(file["file_name"]) is file:
+            del self._by_name[file["file_name"]]
+            candidates = [f for f in self._files.values() if f["file_name"] == file["file_name"]]
+            if candidates:
+                self._by_name[file["file_name"]] = max(candidates, key=_sort_key)
+        self._ordered = None
+
+    async def get_file_ids_by_names(self, file_names: List[str]) -> Dict[str, str]:
+        """
+        Map file names to ids from memory. Names the catalog does not know
+        (not ready, or a NOTIFY still in flight) are looked up in Postgres.
+        """
+        mapping = {}
+        if self.ready:
+            for name in file_names:
+                file = self._by_name.get(name)
+                if file is not None:
+                    mapping[name] = file["id"]
+        missing = [name for name in file_names if name not in mapping]
+        record_cache("file_catalog", hit=not missing)
+        if missing:
+            mapping.update(await self.database_manager.get_file_ids_by_names(missing))
+        return mapping
+
+    def _sorted(self) -> List[dict]:
+        if self._ordered is None:
+            self._ordered = sorted(self._files.values(), key=_sort_key, reverse=True)
+        return self._ordered
+
+    async def list_files(self, limit: Optional[int] = None, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        Files newest first. With limit, returns one keyset page and the
+        cursor for the next one (None on the last page).
+        """
+        if not self.ready:
+            return await self.database_manager.list_files_page(limit, cursor)
+
+        ordered = self._sorted()
+        start = 0
+        if cursor:
+            stamp, file_id = decode_cursor(cursor)
+            position = _sort_key({"downloaded_on": stamp, "id": file_id})
+            # Binary search for the first entry after the cursor (ordered is descending)
+            lo, hi = 0, len(ordered)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if _sort_key(ordered[mid]) < position:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            start = lo
+
+        page = ordered[start:start + limit] if limit else ordered[start:]
+        next_cursor = None
+        if limit and start + limit < len(ordered):
+            next_cursor = encode_cursor(page[-1])
+        return [_public(f) for f in page], next_cursor
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+# Disk budget for cached files (0 disables the cache)
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+# Selections up to this many chunks are searched in memory
+EMBEDDING_CACHE_MAX_CHUNKS = int(os.getenv("EMBEDDING_CACHE_MAX_CHUNKS", "5000"))
+# Seconds a file found without chunks is not looked up again (storing chunks clears it)
+EMBEDDING_CACHE_EMPTY_TTL = float(os.getenv("EMBEDDING_CACHE_EMPTY_TTL", "10"))
+
+# NOTIFY channel carrying the id of each file whose chunks changed, so every process drops it
+EMBEDDINGS_CHANNEL = "embeddings_changed"
+
+CachedFile = namedtuple("CachedFile", ["ids", "texts", "metadatas", "matrix", "nbytes"])
+
+_SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class EmbeddingCache:
+    """
+    Per-file chunk embeddings for exact in-memory search.
+
+    Each file_id is stored as <dir>/<file_id>.npy (normalized float32,
+    opened with mmap_mode="r" so pages are shared between workers through
+    the OS page cache) and <dir>/<file_id>.json (chunk ids, texts and
+    metadata). Files are filled on first use from the vector store and
+    evicted least-recently-used once the total exceeds max_bytes.
+
+    A file is only written when its chunks are complete: nothing was
+    invalidated while it was fetched and the fetched count matches
+    content.chunk_count. Otherwise (mid-ingest) the fetched chunks serve
+    the current query and nothing is kept. Files without chunks are
+    remembered for EMBEDDING_CACHE_EMPTY_TTL seconds.
+
+    Entries are per process, so DatabaseManager.invalidate_embeddings
+    also publishes changes on EMBEDDINGS_CHANNEL and the file catalog's
+    listener calls invalidate() in every other process.
+    """
+
+    def __init__(self, directory: str = EMBEDDING_CACHE_DIR, max_bytes: int = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self._empty: Dict[str, float] = {}
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _paths(self, file_id: str):
+        name = _SAFE_NAME_RE.sub("_", file_id)
+        return os.path.join(self.directory, f"{name}.npy"), os.path.join(self.directory, f"{name}.json")
+
+    def _scan(self):
+        """Register files left by earlier runs, oldest first"""
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                file_id = entry.name[:-4]
+                npy_path, json_path = self._paths(file_id)
+                if os.path.exists(json_path):
+                    found.append((entry.stat().st_mtime, file_id, entry.stat().st_size + os.path.getsize(json_path)))
+        for _, file_id, size in sorted(found):
+            self._sizes[file_id] = size
+
+    def peek(self, file_id: str) -> Optional[CachedFile]:
+        """Loaded entry for file_id, if any (no disk or store access)"""
+        entry = self._entries.get(file_id)
+        if entry is not None:
+            self._entries.move_to_end(file_id)
+            self._sizes.move_to_end(file_id)
+        return entry
+
+    def _read(self, file_id: str) -> Optional[CachedFile]:
+        npy_path, json_path = self._paths(file_id)
+        try:
+            with open(json_path) as f:
+                payload = json.load(f)
+            matrix = np.load(npy_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        nbytes = os.path.getsize(npy_path) + os.path.getsize(json_path)
+        return CachedFile(payload["ids"], payload["texts"], payload["metadatas"], matrix, nbytes)
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _write(self, file_id: str, ids, texts, metadatas, embeddings) -> CachedFile:
+        npy_path, json_path = self._paths(file_id)
+        matrix = self._normalize(embeddings)
+
+        # Write to temporary names and rename, so readers never see partial files
+        with open(json_path + ".tmp", "w") as f:
+            json.dump({"ids": list(ids), "texts": list(texts), "metadatas": list(metadatas)}, f, default=str)
+        with open(npy_path + ".tmp", "wb") as f:
+            np.save(f, matrix)
+        os.replace(json_path + ".tmp", json_path)
+        os.replace(npy_path + ".tmp", npy_path)
+        return self._read(file_id)
+
+    async def load(self, file_id: str, vector_store) -> Optional[CachedFile]:
+        """
+        Entry for file_id: from memory, else from disk, else fetched from
+        the vector store and written to disk. None if the file has no chunks.
+        """
+        entry = self.peek(file_id)
+        if entry is not None:
+            return entry
+        if self._empty.get(file_id, 0.0) > time.monotonic():
+            return None
+
+        lock = self._locks.setdefault(file_id, asyncio.Lock())
+        self._lock_users[file_id] = self._lock_users.get(file_id, 0) + 1
+        try:
+            async with lock:
+                entry = self.peek(file_id)
+                if entry is not None:
+                    return entry
+                entry = await asyncio.to_thread(self._read, file_id)
+                if entry is None:
+                    entry, complete = await self._fetch(file_id, vector_store)
+                    if entry is None or not complete:
+                        return entry
+                self._entries[file_id] = entry
+                self._sizes[file_id] = entry.nbytes
+                self._sizes.move_to_end(file_id)
+                self._evict(keep=file_id)
+                return entry
+        finally:
+            # Keep the lock while others wait on it, or a new caller would start a second load
+            self._lock_users[file_id] -= 1
+            if not self._lock_users[file_id]:
+                del self._lock_users[file_id]
+                del self._locks[file_id]
+
+    async def _fetch(self, file_id: str, vector_store):
+        """(entry, complete) from the vector store; only complete entries are written to disk"""
+        generation = self._generation(file_id)
+        ids, texts, metadatas, embeddings = await vector_store.get_file(file_id)
+        if not ids:
+            self._empty[file_id] = time.monotonic() + EMBEDDING_CACHE_EMPTY_TTL
+            return None, False
+
+        complete = generation == self._generation(file_id)
+        if complete:
+            try:
+                complete = await vector_store.database_manager.count_chunks([file_id]) == len(ids)
+            except Exception as e:
+                logger.warning(f"Could not check the chunk count of {file_id}, not caching it: {e}")
+                complete = False
+        if not complete:
+            logger.info(f"File {file_id} is still being ingested; not caching its embeddings")
+            matrix = self._normalize(embeddings)
+            return CachedFile(list(ids), list(texts), list(metadatas), matrix, matrix.nbytes), False
+
+        entry = await asyncio.to_thread(self._write, file_id, ids, texts, metadatas, embeddings)
+        if generation != self._generation(file_id):
+            # Invalidated while writing: the file on disk may already be stale
+            self.invalidate(file_id)
+            return entry, False
+        logger.info(f"Cached {len(ids)} embeddings for file {file_id}")
+        return entry, True
+
+    def _generation(self, file_id: str):
+        return self._epoch, self._generations.get(file_id, 0)
+
+    def _evict(self, keep: str = None):
+        total = sum(self._sizes.values())
+        for file_id in list(self._sizes):
+            if total <= self.max_bytes:
+                break
+            if file_id == keep:
+                continue
+            total -= self._sizes.pop(file_id)
+            self._entries.pop(file_id, None)
+            for path in self._paths(file_id):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def invalidate(self, file_id: str):
+        """Forget file_id (its chunks changed or were deleted)"""
+        self._generations[file_id] = self._generations.get(file_id, 0) + 1
+        self._empty.pop(file_id, None)
+        self._entries.pop(file_id, None)
+        self._sizes.pop(file_id, None)
+        for path in self._paths(file_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def invalidate_all(self):
+        """Forget every file (invalidations may have been missed, e.g. while the listener was down)"""
+        self._epoch += 1
+        self._empty.clear()
+        for file_id in list(dict.fromkeys([*self._sizes, *self._entries])):
+            self.invalidate(file_id)
+
+    async def search(self, query_embeddings, file_ids: List[str], top_k: int, vector_store,
+                     max_chunks: int = EMBEDDING_CACHE_MAX_CHUNKS):
+        """
+        Exact top-k over the cached embeddings of file_ids.
+
+        Returns None (caller falls back to the vector store) when the
+        selection holds more than max_chunks chunks. Distances are cosine
+        distances (1 - dot product of normalized vectors).
+        """
+        file_ids = list(dict.fromkeys(file_ids))
+        entries = [self.peek(file_id) for file_id in file_ids]
+        hit = all(entry is not None for entry in entries)
+        record_cache("embeddings", hit)
+        if not hit:
+            # Check the size before pulling anything from the store
+            if await vector_store.database_manager.count_chunks(file_ids) > max_chunks:
+                return None
+            entries = [
+                entry if entry is not None else await self.load(file_id, vector_store)
+                for file_id, entry in zip(file_ids, entries)
+            ]
+        entries = [entry for entry in entries if entry is not None]
+        if sum(len(entry.ids) for entry in entries) > max_chunks:
+            return None
+
+        queries = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        results = []
+        for query in queries:
+            candidates = []
+            for entry in entries:
+                scores = entry.matrix @ query
+                k = min(top_k, scores.shape[0])
+                best = np.argpartition(-scores, k - 1)[:k] if k < scores.shape[0] else np.arange(scores.shape[0])
+                candidates.extend((1.0 - float(scores[i]), entry, int(i)) for i in best)
+            candidates.sort(key=lambda c: c[0])
+            results.append([
+                {
+                    "id": entry.ids[i],
+                    "text": entry.texts[i],
+                    "metadata": entry.metadatas[i],
+                    "distance": distance,
+                }
+                for distance, entry, i in candidates[:top_k]
+            ])
+        return results
+
+
+_cache = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide EmbeddingCache (disabled when EMBEDDING_CACHE_MAX_MB=0)"""
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
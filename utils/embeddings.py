@@ -0,0 +1,52 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# dtype embeddings are kept in between encode and the store boundary;
+# float16 halves transient memory, stores still receive float32
+EMBEDDING_DTYPE = np.dtype(os.getenv("EMBEDDING_DTYPE", "float32"))
+# L2-normalize at encode time so dot product == cosine similarity
+NORMALIZE_EMBEDDINGS = os.getenv("NORMALIZE_EMBEDDINGS", "true").lower() == "true"
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """Process-wide SentenceTransformer, loaded once on first use"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+
+                logger.info(f"Loading embedding model {EMBEDDING_MODEL_NAME}")
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _model
+
+
+def encode_texts(texts, batch_size: int = 64, dtype=None) -> np.ndarray:
+    """
+    Encode texts into a contiguous (n, dim) array.
+
+    :param dtype: Output dtype (defaults to EMBEDDING_DTYPE)
+    """
+    model = get_embedding_model()
+    embeddings = model.encode(
+        list(texts),
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=NORMALIZE_EMBEDDINGS,
+        show_progress_bar=False,
+    )
+    return np.ascontiguousarray(embeddings, dtype=dtype or EMBEDDING_DTYPE)
+
+
+def as_float32(embeddings) -> np.ndarray:
+    """Convert embeddings to the contiguous float32 matrix stores expect"""
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
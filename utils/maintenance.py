@@ -0,0 +1,279 @@
+"""
+Vector store maintenance: orphan cleanup, compaction and a before/after report.
+
+    python -m utils.maintenance                 # drop orphans, VACUUM
+    python -m utils.maintenance --rebuild       # also rewrite the collection / reindex HNSW
+
+Chroma never shrinks its SQLite file or HNSW segments on delete, so after
+large purges the store keeps its old size and deleted vectors keep
+slowing down queries. This command:
+
+- drops chunks whose file_id no longer has a content row (orphans left by
+  deletes that failed half way), or whole per-file collections with
+  CHROMA_PARTITION=file
+- with --rebuild, copies the shared collection into a fresh one and
+  swaps it in, which rebuilds its HNSW index without deleted entries;
+  API workers on a Chroma server reopen it by name once the old one is gone
+- VACUUMs the local SQLite store (stop the API first; only one process
+  may open CHROMA_PATH) or, for pgvector, VACUUM (ANALYZE)s
+  document_chunks and with --rebuild reindexes the HNSW index
+
+Store size, chunk count and query latency are measured before and after.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from utils.vector_store import (
+    EMBEDDING_DIM,
+    ChromaVectorStore,
+    PartitionedChromaVectorStore,
+    PgVectorStore,
+    _chroma_space,
+    get_chroma_client,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows per collection.get/add page while scanning or copying a collection
+PAGE_SIZE = 1000
+
+
+def _store_bytes() -> int:
+    """Size on disk of the local Chroma store (0 for a Chroma server)"""
+    if os.getenv("CHROMA_HOST"):
+        return 0
+    total = 0
+    for root, _, files in os.walk(os.getenv("CHROMA_PATH", "chroma_store")):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+async def _pg_bytes(db_manager) -> int:
+    async with db_manager.get_connection("ingest") as conn:
+        cursor = await conn.execute("SELECT pg_total_relation_size('document_chunks');")
+        return (await cursor.fetchone())[0]
+
+
+async def _known_file_ids(db_manager) -> set:
+    async with db_manager.get_connection("ingest") as conn:
+        cursor = await conn.execute("SELECT id FROM content;")
+        return {row[0] for row in await cursor.fetchall()}
+
+
+async def _sample_file_ids(db_manager, n: int) -> list:
+    async with db_manager.get_connection("ingest") as conn:
+        cursor = await conn.execute(
+            "SELECT id FROM content WHERE chunk_count > 0 ORDER BY random() LIMIT %s;", (n,)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+
+def _chunk_count(store) -> int:
+    if isinstance(store, ChromaVectorStore):
+        return store.collection.count()
+    if isinstance(store, PartitionedChromaVectorStore):
+        return sum(
+            store.client.get_collection(name).count() for name in _partition_names(store)
+        )
+    return -1
+
+
+def _partition_names(store: PartitionedChromaVectorStore) -> list:
+    prefix = f"{store.prefix}_"
+    names = [getattr(c, "name", c) for c in store.client.list_collections()]
+    return [name for name in names if name.startswith(prefix)]
+
+
+def _percentiles(report: dict, prefix: str, latencies: list):
+    if latencies:
+        report[f"{prefix}_p50_ms"] = round(float(np.percentile(latencies, 50)) * 1000, 2)
+        report[f"{prefix}_p95_ms"] = round(float(np.percentile(latencies, 95)) * 1000, 2)
+
+
+async def measure(db_manager, queries: int, top_k: int = 15) -> dict:
+    """
+    Store size, chunk count and single-file query latency (random unit vectors).
+
+    ann_* times ann_query, the HNSW index a rebuild or reindex touches;
+    single files are usually small enough for query() to scan them exactly,
+    which query_* (the path chat requests take) reports.
+    """
+    store = db_manager.vector_store
+    if isinstance(store, PgVectorStore):
+        size = await _pg_bytes(db_manager)
+        async with db_manager.get_connection("ingest") as conn:
+            cursor = await conn.execute("SELECT count(*) FROM document_chunks;")
+            chunks = (await cursor.fetchone())[0]
+    else:
+        size = await asyncio.to_thread(_store_bytes)
+        chunks = await asyncio.to_thread(_chunk_count, store)
+
+    latencies = {"ann": [], "query": []}
+    file_ids = await _sample_file_ids(db_manager, queries)
+    rng = np.random.default_rng(0)
+    for i in range(queries if file_ids else 0):
+        vector = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+        for path, search in (("ann", store.ann_query), ("query", store.query)):
+            started = time.perf_counter()
+            await search([vector.tolist()], [file_ids[i % len(file_ids)]], top_k)
+            latencies[path].append(time.perf_counter() - started)
+
+    report = {"store_bytes": size, "chunks": chunks}
+    for path, values in latencies.items():
+        _percentiles(report, path, values)
+    return report
+
+
+def _pages(collection, include):
+    """
+    The whole collection in PAGE_SIZE pages, fetched by id.
+
+    limit/offset paging rescans the skipped rows on every page (quadratic
+    on large stores), so the ids are listed once and fetched in batches.
+    """
+    ids = collection.get(include=[])["ids"]
+    for start in range(0, len(ids), PAGE_SIZE):
+        yield collection.get(ids=ids[start:start + PAGE_SIZE], include=include)
+
+
+def _drop_orphans_chroma(collection, known: set) -> int:
+    orphans = []
+    for page in _pages(collection, ["metadatas"]):
+        for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+            if (metadata or {}).get("file_id") not in known:
+                orphans.append(chunk_id)
+    for start in range(0, len(orphans), PAGE_SIZE):
+        collection.delete(ids=orphans[start:start + PAGE_SIZE])
+    return len(orphans)
+
+
+def _drop_orphans_partitioned(store: PartitionedChromaVectorStore, known: set) -> int:
+    dropped = 0
+    prefix = f"{store.prefix}_"
+    for name in _partition_names(store):
+        if name[len(prefix):] not in known:
+            store.client.delete_collection(name)
+            dropped += 1
+    return dropped
+
+
+def _rebuild_collection(client, collection):
+    """
+    Copy collection into a fresh one with the same space and swap it in by name.
+
+    The old collection is renamed aside before the fresh one takes its
+    name and is only dropped once the swap is done, so an error never
+    leaves CHROMA_COLLECTION missing with the chunks stranded elsewhere.
+    """
+    name = collection.name
+    stamp = int(time.time())
+    fresh = client.create_collection(f"{name}_rebuild_{stamp}", metadata={"hnsw:space": _chroma_space(collection)})
+    try:
+        for page in _pages(collection, ["embeddings", "documents", "metadatas"]):
+            fresh.add(
+                ids=page["ids"], embeddings=page["embeddings"],
+                documents=page["documents"], metadatas=page["metadatas"],
+            )
+    except Exception:
+        client.delete_collection(fresh.name)
+        raise
+
+    collection.modify(name=f"{name}_previous_{stamp}")
+    try:
+        fresh.modify(name=name)
+    except Exception:
+        collection.modify(name=name)
+        raise
+    client.delete_collection(collection.name)
+    return fresh
+
+
+def _vacuum_sqlite():
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    # Close the cached client so nothing holds the database open
+    SharedSystemClient.clear_system_cache()
+    path = os.path.join(os.getenv("CHROMA_PATH", "chroma_store"), "chroma.sqlite3")
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("VACUUM;")
+    finally:
+        connection.close()
+
+
+async def _maintain_pgvector(db_manager, rebuild: bool, vacuum: bool):
+    async with db_manager.get_connection("ingest") as conn:
+        # VACUUM and REINDEX cannot run inside a transaction
+        await conn.set_autocommit(True)
+        try:
+            if rebuild:
+                await conn.execute("REINDEX INDEX idx_chunks_embedding_hnsw;")
+            if vacuum:
+                await conn.execute("VACUUM (ANALYZE) document_chunks;")
+        finally:
+            await conn.set_autocommit(False)
+
+
+async def run_maintenance(args) -> dict:
+    from utils import DatabaseManager
+
+    db_manager = DatabaseManager()
+    if not db_manager.initialize_pool():
+        raise SystemExit("Database initialization failed")
+    await db_manager.open_pool()
+    try:
+        await db_manager.initialize_vector_store()
+        store = db_manager.vector_store
+        report = {"backend": type(store).__name__, "before": await measure(db_manager, args.queries)}
+        logger.info(f"Before: {report['before']}")
+
+        if isinstance(store, PgVectorStore):
+            # Chunks cascade with their content rows, so there are no orphans to drop
+            await _maintain_pgvector(db_manager, args.rebuild, not args.no_vacuum)
+        else:
+            known = await _known_file_ids(db_manager)
+            if isinstance(store, PartitionedChromaVectorStore):
+                report["orphans_dropped"] = await asyncio.to_thread(_drop_orphans_partitioned, store, known)
+            else:
+                report["orphans_dropped"] = await asyncio.to_thread(_drop_orphans_chroma, store.collection, known)
+                if args.rebuild:
+                    await asyncio.to_thread(_rebuild_collection, get_chroma_client(), store.collection)
+            logger.info(f"Dropped {report['orphans_dropped']} orphaned chunks/collections")
+
+            if not args.no_vacuum and not os.getenv("CHROMA_HOST"):
+                await asyncio.to_thread(_vacuum_sqlite)
+            # Reopen: the vacuum closed the client and a rebuild replaced the collection
+            await db_manager.initialize_vector_store()
+
+        report["after"] = await measure(db_manager, args.queries)
+        logger.info(f"After: {report['after']}")
+        return report
+    finally:
+        await db_manager.close_pool()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="Rewrite the collection / reindex HNSW")
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip VACUUM")
+    parser.add_argument("--queries", type=int, default=100, help="Queries per latency measurement")
+    parser.add_argument("--output", help="Write the before/after figures as JSON to this path")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(run_maintenance(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
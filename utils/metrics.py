@@ -0,0 +1,228 @@
+"""
+Minimal in-process metrics registry.
+
+Counters, gauges and histograms rendered in the Prometheus text exposition
+format, served on /metrics. Values are per process; with several workers
+each one reports its own series.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time spent inside the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            for i, bound in enumerate(self.buckets):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(state[i])}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ─── Application metrics ─────────────────────────────────────────────────────
+
+NODE_LATENCY = histogram(
+    "rag_node_latency_seconds", "Wall time spent in each graph node", ["node"]
+)
+CHAT_LATENCY = histogram(
+    "rag_chat_request_seconds", "End-to-end chat completion time, including streaming"
+)
+TIME_TO_FIRST_TOKEN = histogram(
+    "rag_time_to_first_token_seconds", "Time from request to the first streamed answer token"
+)
+LLM_TOKENS = counter(
+    "rag_llm_tokens_total", "LLM tokens consumed", ["model", "direction"]
+)
+LLM_ATTEMPTS = counter(
+    "rag_llm_attempts_total", "LLM calls per model by outcome (ok, hedged, timeout, rate_limited, unavailable, error)",
+    ["model", "outcome"],
+)
+LLM_LATENCY = histogram(
+    "rag_llm_latency_seconds", "First token (stream) or full response (invoke) time of winning LLM attempts",
+    ["model", "mode"],
+)
+RETRY_DECISIONS = counter(
+    "rag_retry_decisions_total", "should_retry outcomes", ["decision"]
+)
+CACHE_REQUESTS = counter(
+    "rag_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+RETRIEVAL_STAGE_LATENCY = histogram(
+    "rag_retrieval_stage_seconds", "Retrieve node stages (embed, search, rerank) by attempt", ["stage", "attempt"]
+)
+VECTOR_SEARCH_LATENCY = histogram(
+    "rag_vector_search_seconds", "Vector store query time by search strategy", ["strategy"]
+)
+ADMISSION = gauge(
+    "rag_admission", "Admission controller in-flight, waiting and pressure", ["controller", "stat"]
+)
+ADMISSION_REJECTED = counter(
+    "rag_admission_rejected_total", "Requests rejected with 429 by reason", ["controller", "reason"]
+)
+LOAD_SHED = counter(
+    "rag_load_shed_total", "Optional work skipped under admission pressure", ["action"]
+)
+STORAGE_TRANSFER_LATENCY = histogram(
+    "rag_storage_transfer_seconds", "B2/S3 object transfer time", ["op"]
+)
+DB_POOL = gauge(
+    "rag_db_pool", "Database pool figures from psycopg_pool", ["pool", "stat"]
+)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_latest(pool_stats: dict = None) -> str:
+    """Render all metrics, refreshing the pool gauges from pool_stats first"""
+    for pool, stats in (pool_stats or {}).items():
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)):
+                DB_POOL.set(value, pool=pool, stat=stat)
+    return REGISTRY.render()
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    One running producer and the items it has emitted so far.
+
+    Subscribers replay items from the start, so one that joins late still
+    receives the whole stream. The producer can leave a value in result
+    (e.g. the final answer) for subscribers to read once the stream ends.
+
+    The producer also decides whether others may join at all (its output
+    may turn out to depend on its own caller); until it does, callers
+    wait in wait_joinable().
+    """
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.result = None
+        self.subscribers = 0
+        self.task = None
+        self.joinable: Optional[bool] = None
+        self._decided = asyncio.Event()
+        self._forget = None
+        self._changed = asyncio.Condition()
+
+    def decide(self, joinable: bool):
+        """Set once by the producer; a flight nobody may join gives up its key"""
+        if self.joinable is not None:
+            return
+        self.joinable = joinable
+        self._decided.set()
+        if not joinable and self._forget is not None:
+            self._forget()
+
+    async def wait_joinable(self) -> bool:
+        await self._decided.wait()
+        return self.joinable
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def listen(self) -> AsyncIterator:
+        """Yield every item of the flight; the producer is cancelled when the last listener leaves early"""
+        index = 0
+        try:
+            while True:
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                if self.done:
+                    return
+                async with self._changed:
+                    await self._changed.wait_for(lambda: index < len(self.items) or self.done)
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical work onto one producer.
+
+    join(key, produce) attaches to the running flight for key or starts
+    produce(flight), an async iterator, as a background task; every caller
+    then iterates flight.listen() and receives the same items. Callers that
+    need to check a flight first use get(), then follow() or start(). The
+    key is released as soon as the producer finishes (or decides the
+    flight is not joinable), so later requests start a fresh flight.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+
+    def get(self, key: Hashable):
+        """The running flight for key, if any"""
+        flight = self._flights.get(key)
+        return flight if flight is not None and not flight.done else None
+
+    def follow(self, flight: Flight) -> Flight:
+        """Subscribe to a flight returned by get()"""
+        flight.subscribers += 1
+        return flight
+
+    def start(self, key: Hashable, produce: Callable[[Flight], AsyncIterator]) -> Flight:
+        """Start a new flight for key, replacing any running one as the flight later callers find"""
+        flight = Flight()
+        flight.subscribers = 1
+        flight._forget = lambda: self._forget(key, flight)
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(self._run(key, flight, produce))
+        return flight
+
+    def join(self, key: Hashable, produce: Callable[[Flight], AsyncIterator]) -> Tuple[Flight, bool]:
+        """Return (flight, True if this caller started it)"""
+        flight = self.get(key)
+        if flight is not None:
+            return self.follow(flight), False
+        return self.start(key, produce), True
+
+    def _forget(self, key, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _run(self, key, flight: Flight, produce):
+        try:
+            async for item in produce(flight):
+                flight.items.append(item)
+                await flight._notify()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Single-flight producer failed: {e}")
+        finally:
+            flight.done = True
+            self._forget(key, flight)
+            # Nobody waits on a flight that ended before deciding
+            flight.decide(False)
+            await flight._notify()
+
+    def __len__(self):
+        return len(self._flights)
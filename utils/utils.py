@@ -4,7 +4,6 @@ import jwt, datetime
 from fastapi import Header, HTTPException, status
 
 import re
-from rank_bm25 import BM25Okapi
 from typing import List
 
 from dotenv import load_dotenv
@@ -54,23 +53,27 @@ class BM25Reranker:
     def __init__(self):
         pass
 
-    def rerank(
-        self,
-        query: str,
-        documents: List[str],
-        top_k: int
-    ) -> List[str]:
+    def scores(self, query: str, documents: List[str]) -> List[float]:
+        """BM25 score of each document for query"""
         if not documents:
             return []
 
+        from rank_bm25 import BM25Okapi
+
         tokenized_docs = [_tokenize(doc) for doc in documents]
         bm25 = BM25Okapi(tokenized_docs)
 
         tokenized_query = _tokenize(query)
-        scores = bm25.get_scores(tokenized_query)
+        return [float(score) for score in bm25.get_scores(tokenized_query)]
 
+    def rerank(
+        self,
+        query: str,
+        documents: List[str],
+        top_k: int
+    ) -> List[str]:
         ranked = sorted(
-            zip(documents, scores),
+            zip(documents, self.scores(query, documents)),
             key=lambda x: x[1],
             reverse=True
         )
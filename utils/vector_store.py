@@ -0,0 +1,516 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+from utils.embeddings import as_float32
+from utils.metrics import VECTOR_SEARCH_LATENCY
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+# Selections up to this many chunks are searched exactly instead of through the ANN index
+# (unset: each backend's default, see bench/ann_strategies.py)
+EXACT_SEARCH_MAX_CHUNKS = os.getenv("EXACT_SEARCH_MAX_CHUNKS")
+
+
+def clean_metadata_for_chroma(metadata_dict):
+    """Clean metadata to remove None values and ensure compatible types for ChromaDB"""
+    cleaned = {}
+    for key, value in metadata_dict.items():
+        if value is not None:
+            # Convert to appropriate types that ChromaDB supports
+            if isinstance(value, (str, int, float, bool)):
+                cleaned[key] = value
+            else:
+                # Convert complex and other types to string representation
+                cleaned[key] = str(value)
+        # Skip None values entirely
+    return cleaned
+
+
+def exact_top_k(matrix: np.ndarray, query_embeddings, top_k: int, space: str = "cosine"):
+    """
+    Brute-force nearest neighbours of each query within matrix.
+
+    Distances follow the Chroma conventions for space: "l2" is squared
+    Euclidean, "cosine" is 1 - cosine similarity and "ip" is 1 - dot product.
+    Returns [(row indices, distances)] per query, closest first.
+    """
+    queries = as_float32(query_embeddings)
+    if matrix.shape[0] == 0:
+        return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+
+    dots = queries @ matrix.T
+    if space == "l2":
+        distances = (
+            np.einsum("ij,ij->i", queries, queries)[:, None]
+            - 2 * dots
+            + np.einsum("ij,ij->i", matrix, matrix)[None, :]
+        )
+    elif space == "cosine":
+        norms = np.linalg.norm(queries, axis=1)[:, None] * np.linalg.norm(matrix, axis=1)[None, :]
+        distances = 1 - dots / np.maximum(norms, 1e-12)
+    else:
+        distances = 1 - dots
+
+    k = min(top_k, matrix.shape[0])
+    results = []
+    for row in distances:
+        candidates = np.argpartition(row, k - 1)[:k] if k < row.shape[0] else np.arange(row.shape[0])
+        order = candidates[np.argsort(row[candidates])]
+        results.append((order, row[order]))
+    return results
+
+
+class VectorStore:
+    """
+    Interface for chunk embedding storage and filtered similarity search.
+
+    Results are dicts with id, text, metadata and distance (lower is closer).
+    persists_chunks is True when the backend writes the document_chunks row
+    itself, so save_chunk_embeddings must not insert it separately.
+
+    query() picks a strategy from the number of chunks in the selected files:
+    a filtered HNSW search degrades (recall and latency) when the selection
+    is a small fraction of the index, so selections of at most
+    exact_search_max_chunks are scanned exactly after pre-filtering on
+    file_id, and larger ones go through the ANN index.
+    """
+
+    persists_chunks = False
+    exact_search_max_chunks = 0
+
+    def __init__(self, database_manager, exact_search_max_chunks: int = None):
+        self.database_manager = database_manager
+        if exact_search_max_chunks is None and EXACT_SEARCH_MAX_CHUNKS:
+            exact_search_max_chunks = int(EXACT_SEARCH_MAX_CHUNKS)
+        if exact_search_max_chunks is not None:
+            self.exact_search_max_chunks = exact_search_max_chunks
+
+    async def setup(self):
+        """Create whatever the backend needs (tables, indexes)"""
+
+    async def add(self, ids: List[str], embeddings, documents: List[str],
+                  metadatas: List[Dict[str, Any]], file_id: str):
+        raise NotImplementedError
+
+    async def choose_strategy(self, file_ids: List[str]) -> str:
+        """"exact" or "ann" for a selection, from the chunk counts kept in Postgres"""
+        if self.exact_search_max_chunks <= 0:
+            return "ann"
+        try:
+            selected = await self.database_manager.count_chunks(file_ids)
+        except Exception as e:
+            logger.warning(f"Could not count selected chunks, using ANN search: {e}")
+            return "ann"
+        return "exact" if selected <= self.exact_search_max_chunks else "ann"
+
+    async def query(self, query_embeddings, file_ids: List[str], top_k: int) -> List[List[Dict[str, Any]]]:
+        """Top-k matches within file_ids for each query embedding"""
+        if not file_ids:
+            return [[] for _ in range(len(query_embeddings))]
+        strategy = await self.choose_strategy(file_ids)
+        with VECTOR_SEARCH_LATENCY.time(strategy=strategy):
+            if strategy == "exact":
+                return await self.exact_query(query_embeddings, file_ids, top_k)
+            return await self.ann_query(query_embeddings, file_ids, top_k)
+
+    async def exact_query(self, query_embeddings, file_ids: List[str], top_k: int) -> List[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    async def ann_query(self, query_embeddings, file_ids: List[str], top_k: int) -> List[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    async def get_file(self, file_id: str):
+        """All chunks of one file as (ids, texts, metadatas, (n, dim) embeddings)"""
+        raise NotImplementedError
+
+    async def delete(self, file_ids: List[str]):
+        raise NotImplementedError
+
+    async def delete_chunks(self, file_id: str, chunk_ids: List[str]):
+        """Delete individual chunks of one file"""
+        raise NotImplementedError
+
+
+def _chroma_matches(results) -> List[List[Dict[str, Any]]]:
+    """Chroma returns parallel arrays; reshape to one list of dicts per query"""
+    matches = []
+    for q in range(len(results.get("ids") or [])):
+        matches.append([
+            {
+                "id": results["ids"][q][i],
+                "text": results["documents"][q][i],
+                "metadata": results["metadatas"][q][i],
+                "distance": results["distances"][q][i],
+            }
+            for i in range(len(results["ids"][q]))
+        ])
+    return matches
+
+
+def _chroma_rows(rows):
+    embeddings = np.asarray(rows["embeddings"], dtype=np.float32).reshape(len(rows["ids"]), -1)
+    return rows["ids"], rows["documents"], rows["metadatas"], embeddings
+
+
+def _chroma_space(collection) -> str:
+    """Distance function of a Chroma collection ("l2" unless configured otherwise)"""
+    hnsw = (getattr(collection, "configuration", None) or {}).get("hnsw") or {}
+    return hnsw.get("space") or (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    Single Chroma collection for all files, filtered by file_id metadata.
+
+    Exact search pulls the selection's embeddings with collection.get, which
+    only beats the filtered HNSW query for small selections.
+
+    With a client, a collection that no longer exists (replaced by
+    `python -m utils.maintenance --rebuild`, possibly from another host) is
+    looked up again by name and the call retried once.
+    """
+
+    exact_search_max_chunks = 2000
+
+    def __init__(self, database_manager, collection, client=None, **kwargs):
+        super().__init__(database_manager, **kwargs)
+        self.collection = collection
+        self.client = client
+        self.name = collection.name
+        self.space = _chroma_space(collection)
+
+    def _call(self, method: str, **kwargs):
+        from chromadb.errors import NotFoundError
+
+        try:
+            return getattr(self.collection, method)(**kwargs)
+        except NotFoundError:
+            if self.client is None:
+                raise
+            logger.info(f"Chroma collection {self.name} was replaced, reopening it")
+            self.collection = self.client.get_collection(self.name)
+            return getattr(self.collection, method)(**kwargs)
+
+    async def add(self, ids, embeddings, documents, metadatas, file_id):
+        await asyncio.to_thread(
+            self._call, "add",
+            ids=ids,
+            documents=documents,
+            embeddings=as_float32(embeddings),
+            metadatas=[clean_metadata_for_chroma(m) for m in metadatas],
+        )
+
+    async def ann_query(self, query_embeddings, file_ids, top_k):
+        results = await asyncio.to_thread(
+            self._call, "query",
+            query_embeddings=as_float32(query_embeddings),
+            n_results=top_k,
+            where={"file_id": {"$in": file_ids}},
+            include=["documents", "metadatas", "distances"],
+        )
+
+        return _chroma_matches(results)
+
+    async def exact_query(self, query_embeddings, file_ids, top_k):
+        rows = await asyncio.to_thread(
+            self._call, "get",
+            where={"file_id": {"$in": file_ids}},
+            include=["embeddings", "documents", "metadatas"],
+        )
+        matrix = np.asarray(rows["embeddings"], dtype=np.float32).reshape(len(rows["ids"]), -1)
+        return [
+            [
+                {
+                    "id": rows["ids"][i],
+                    "text": rows["documents"][i],
+                    "metadata": rows["metadatas"][i],
+                    "distance": float(distance),
+                }
+                for i, distance in zip(indices, distances)
+            ]
+            for indices, distances in exact_top_k(matrix, query_embeddings, top_k, self.space)
+        ]
+
+    async def get_file(self, file_id):
+        rows = await asyncio.to_thread(
+            self._call, "get",
+            where={"file_id": file_id},
+            include=["embeddings", "documents", "metadatas"],
+        )
+        return _chroma_rows(rows)
+
+    async def delete(self, file_ids):
+        await asyncio.to_thread(self._call, "delete", where={"file_id": {"$in": file_ids}})
+
+    async def delete_chunks(self, file_id, chunk_ids):
+        await asyncio.to_thread(self._call, "delete", ids=chunk_ids)
+
+
+class PartitionedChromaVectorStore(VectorStore):
+    """
+    One Chroma collection per file ("<prefix>_<file_id>").
+
+    A query searches only the selected files' collections and merges the
+    results by distance, so there is no metadata filter for HNSW to work
+    around and per-file indexes stay small. Deleting a file drops its
+    collection.
+    """
+
+    def __init__(self, database_manager, client, prefix: str = "chunks", **kwargs):
+        super().__init__(database_manager, **kwargs)
+        self.client = client
+        self.prefix = prefix
+        self._collections = {}
+
+    def _name(self, file_id: str) -> str:
+        return f"{self.prefix}_{file_id}"
+
+    def _collection(self, file_id: str, create: bool = False):
+        collection = self._collections.get(file_id)
+        if collection is None:
+            if create:
+                collection = self.client.get_or_create_collection(self._name(file_id))
+            else:
+                try:
+                    collection = self.client.get_collection(self._name(file_id))
+                except Exception:
+                    return None
+            self._collections[file_id] = collection
+        return collection
+
+    async def add(self, ids, embeddings, documents, metadatas, file_id):
+        collection = await asyncio.to_thread(self._collection, file_id, True)
+        await asyncio.to_thread(
+            collection.add,
+            ids=ids,
+            documents=documents,
+            embeddings=as_float32(embeddings),
+            metadatas=[clean_metadata_for_chroma(m) for m in metadatas],
+        )
+
+    def _query_file(self, file_id, query_embeddings, top_k):
+        collection = self._collection(file_id)
+        if collection is None:
+            return [[] for _ in range(len(query_embeddings))]
+        try:
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=top_k,
+                include=["documents", "metadatas", "distances"],
+            )
+        except Exception as e:
+            # Dropped by another worker since it was cached
+            logger.warning(f"Chroma collection for {file_id} unavailable: {e}")
+            self._collections.pop(file_id, None)
+            return [[] for _ in range(len(query_embeddings))]
+        return _chroma_matches(results)
+
+    async def query(self, query_embeddings, file_ids, top_k):
+        query_embeddings = as_float32(query_embeddings)
+        with VECTOR_SEARCH_LATENCY.time(strategy="partitioned"):
+            per_file = await asyncio.gather(*(
+                asyncio.to_thread(self._query_file, file_id, query_embeddings, top_k)
+                for file_id in dict.fromkeys(file_ids)
+            ))
+        return [
+            sorted((m for matches in per_file for m in matches[q]), key=lambda m: m["distance"])[:top_k]
+            for q in range(len(query_embeddings))
+        ]
+
+    async def get_file(self, file_id):
+        collection = await asyncio.to_thread(self._collection, file_id)
+        if collection is None:
+            return [], [], [], np.empty((0, 0), dtype=np.float32)
+        rows = await asyncio.to_thread(collection.get, include=["embeddings", "documents", "metadatas"])
+        return _chroma_rows(rows)
+
+    async def delete(self, file_ids):
+        for file_id in file_ids:
+            self._collections.pop(file_id, None)
+            try:
+                await asyncio.to_thread(self.client.delete_collection, self._name(file_id))
+            except Exception as e:
+                logger.warning(f"Could not drop Chroma collection for {file_id}: {e}")
+
+    async def delete_chunks(self, file_id, chunk_ids):
+        collection = await asyncio.to_thread(self._collection, file_id)
+        if collection is not None:
+            await asyncio.to_thread(collection.delete, ids=chunk_ids)
+
+
+def _vector_literal(vector) -> str:
+    return "[" + ",".join(f"{x:.7g}" for x in vector) + "]"
+
+
+class PgVectorStore(VectorStore):
+    """
+    pgvector backend: embeddings live on document_chunks next to the text.
+
+    Uses an HNSW cosine index and applies the file_id filter in the same
+    query, so retrieval is one round trip to one system. Exact search reads
+    the selection through idx_chunks_file_id and sorts it, bypassing HNSW.
+    iterative_scan ("relaxed_order"/"strict_order", pgvector >= 0.8) lets a
+    filtered HNSW scan keep going until top_k rows pass the filter.
+    """
+
+    persists_chunks = True
+    exact_search_max_chunks = 20000
+
+    def __init__(self, database_manager, dimension: int = EMBEDDING_DIM,
+                 ef_search: int = int(os.getenv("PGVECTOR_EF_SEARCH", "100")),
+                 iterative_scan: str = os.getenv("PGVECTOR_ITERATIVE_SCAN", "off"), **kwargs):
+        super().__init__(database_manager, **kwargs)
+        self.dimension = dimension
+        self.ef_search = ef_search
+        if iterative_scan not in ("off", "relaxed_order", "strict_order"):
+            raise ValueError(f"Invalid PGVECTOR_ITERATIVE_SCAN: {iterative_scan}")
+        self.iterative_scan = iterative_scan
+
+    async def setup(self):
+        setup_sql = f"""
+        CREATE EXTENSION IF NOT EXISTS vector;
+        ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding vector({self.dimension});
+        CREATE INDEX IF NOT EXISTS idx_chunks_embedding_hnsw
+            ON document_chunks USING hnsw (embedding vector_cosine_ops)
+            WITH (m = 16, ef_construction = 64);
+        """
+        async with self.database_manager.get_connection("ingest") as conn:
+            await conn.execute(setup_sql)
+            await conn.commit()
+
+    async def add(self, ids, embeddings, documents, metadatas, file_id):
+        insert_sql = """
+        INSERT INTO document_chunks (id, file_id, chunk_text, metadata, embedding)
+        VALUES (%s, %s, %s, %s, %s::vector)
+        ON CONFLICT (id) DO UPDATE SET embedding = EXCLUDED.embedding;
+        """
+        rows = [
+            (chunk_id, file_id, text, json.dumps(metadata, default=str), _vector_literal(vector))
+            for chunk_id, text, metadata, vector in zip(ids, documents, metadatas, as_float32(embeddings))
+        ]
+        async with self.database_manager.get_connection("ingest") as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(insert_sql, rows)
+            await conn.commit()
+
+    async def ann_query(self, query_embeddings, file_ids, top_k):
+        query_sql = """
+        SELECT id, chunk_text, metadata, embedding <=> %(q)s::vector AS distance
+        FROM document_chunks
+        WHERE file_id = ANY(%(file_ids)s) AND embedding IS NOT NULL
+        ORDER BY embedding <=> %(q)s::vector
+        LIMIT %(k)s;
+        """
+        settings = [f"SET LOCAL hnsw.ef_search = {int(self.ef_search)}"]
+        if self.iterative_scan != "off":
+            settings.append(f"SET LOCAL hnsw.iterative_scan = {self.iterative_scan}")
+        return await self._run_queries(query_sql, query_embeddings, file_ids, top_k, settings)
+
+    async def exact_query(self, query_embeddings, file_ids, top_k):
+        # The materialized CTE keeps the planner from answering the ORDER BY with HNSW
+        query_sql = """
+        WITH selected AS MATERIALIZED (
+            SELECT id, chunk_text, metadata, embedding
+            FROM document_chunks
+            WHERE file_id = ANY(%(file_ids)s) AND embedding IS NOT NULL
+        )
+        SELECT id, chunk_text, metadata, embedding <=> %(q)s::vector AS distance
+        FROM selected
+        ORDER BY distance
+        LIMIT %(k)s;
+        """
+        return await self._run_queries(query_sql, query_embeddings, file_ids, top_k)
+
+    async def _run_queries(self, query_sql, query_embeddings, file_ids, top_k, settings=()):
+        matches = []
+        async with self.database_manager.get_connection() as conn:
+            async with conn.transaction():
+                for setting in settings:
+                    await conn.execute(setting)
+                async with conn.cursor() as cur:
+                    for vector in as_float32(query_embeddings):
+                        await cur.execute(
+                            query_sql,
+                            {"q": _vector_literal(vector), "file_ids": file_ids, "k": top_k},
+                        )
+                        rows = await cur.fetchall()
+                        matches.append([
+                            {"id": row[0], "text": row[1], "metadata": row[2], "distance": row[3]}
+                            for row in rows
+                        ])
+        return matches
+
+    async def get_file(self, file_id):
+        async with self.database_manager.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT id, chunk_text, metadata, embedding::text FROM document_chunks "
+                    "WHERE file_id = %s AND embedding IS NOT NULL;",
+                    (file_id,),
+                )
+                rows = await cur.fetchall()
+        embeddings = np.array([json.loads(row[3]) for row in rows], dtype=np.float32)
+        return [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows], embeddings
+
+    async def delete(self, file_ids):
+        async with self.database_manager.get_connection("ingest") as conn:
+            await conn.execute("DELETE FROM document_chunks WHERE file_id = ANY(%s);", (file_ids,))
+            await conn.commit()
+
+    async def delete_chunks(self, file_id, chunk_ids):
+        async with self.database_manager.get_connection("ingest") as conn:
+            await conn.execute("DELETE FROM document_chunks WHERE id = ANY(%s);", (chunk_ids,))
+            await conn.commit()
+
+
+def get_chroma_client():
+    """
+    Open the Chroma client.
+
+    With CHROMA_HOST set this talks to a Chroma server (`chroma run`), which
+    any number of API workers can share; otherwise it opens the local
+    SQLite-backed store at CHROMA_PATH, which only one process may use.
+    """
+    import chromadb
+
+    host = os.getenv("CHROMA_HOST")
+    if host:
+        client = chromadb.HttpClient(host=host, port=int(os.getenv("CHROMA_PORT", "8000")))
+        logger.info(f"Using Chroma server at {host}")
+    else:
+        # gunicorn.conf.py refuses to start several workers on this store
+        client = chromadb.PersistentClient(path=os.getenv("CHROMA_PATH", "chroma_store"))
+    return client
+
+
+def get_chroma_collection(client=None):
+    """Open the shared CHROMA_COLLECTION collection"""
+    return (client or get_chroma_client()).get_or_create_collection(os.getenv("CHROMA_COLLECTION", "document_chunks"))
+
+
+def create_vector_store(database_manager) -> VectorStore:
+    """
+    Build the backend named by VECTOR_STORE ("chroma" or "pgvector").
+
+    CHROMA_PARTITION=file stores each file in its own Chroma collection.
+    """
+    backend = os.getenv("VECTOR_STORE", "chroma").lower()
+    if backend == "pgvector":
+        return PgVectorStore(database_manager)
+    if backend == "chroma":
+        partition = os.getenv("CHROMA_PARTITION", "none").lower()
+        if partition == "file":
+            return PartitionedChromaVectorStore(
+                database_manager, get_chroma_client(), os.getenv("CHROMA_COLLECTION", "document_chunks")
+            )
+        if partition != "none":
+            raise ValueError(f"Unknown CHROMA_PARTITION: {partition}")
+        client = get_chroma_client()
+        return ChromaVectorStore(database_manager, get_chroma_collection(client), client)
+    raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")